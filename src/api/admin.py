@@ -0,0 +1,43 @@
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException
+
+from src.api.token import current_user
+from src.config import DNSBL_BREAKER_COOLDOWN, DNSBL_BREAKER_MIN_SAMPLES, DNSBL_BREAKER_RATE, DNSBL_MAX_LISTS
+from src.db.db import get_db
+from src.processor.dnsbl_health import read_health
+from src.processor.service import DNSBL_LISTS, DOMAIN_DNSBL_LISTS
+
+router = APIRouter()
+
+
+def require_admin(db=Depends(get_db), token_doc=Depends(current_user)):
+    user = db.users.find_one({"_id": ObjectId(token_doc["user_id"])}, {"role": 1})
+
+    if not user or user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    return token_doc
+
+
+def breaker_state(health: dict) -> str:
+    if health["open_for"]:
+        return "open"
+    return "half_open" if health["half_open"] else "closed"
+
+
+@router.get("/admin/dnsbl", tags=["admin"], summary="Health and circuit breaker state of every blacklist")
+def dnsbl_state(token_doc=Depends(require_admin)):
+    lists = DNSBL_LISTS[:DNSBL_MAX_LISTS] + DOMAIN_DNSBL_LISTS
+
+    try:
+        health = read_health(lists)
+    except Exception as e:
+        print("dnsbl sagligi okunamadi:", repr(e), flush=True)
+        raise HTTPException(status_code=503, detail="Health data unavailable")
+
+    return {
+        "breaker": {"min_samples": DNSBL_BREAKER_MIN_SAMPLES, "failure_rate": DNSBL_BREAKER_RATE,
+                    "cooldown_seconds": DNSBL_BREAKER_COOLDOWN},
+        "lists": [dict(health[name], list=name, state=breaker_state(health[name]))
+                  for name in lists],
+    }
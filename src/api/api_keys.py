@@ -5,9 +5,11 @@ from datetime import datetime, timezone
 from bson import ObjectId
 from bson.errors import InvalidId
 from fastapi import APIRouter, Depends, HTTPException, Request
+from pymongo import ReturnDocument
 
+from src.api.auth_cache import lookup, revoke, store, touch_key
 from src.api.functions import get_request_info, system_log, utc_tomorrow_start
-from src.api.rate_limit import enforce
+from src.api.rate_limit import enforce, enforce_async
 from src.api.schema import ApiKeyCreate
 from src.api.token import current_user
 from src.config import (
@@ -60,14 +62,44 @@ def resolve_api_key(request: Request, db) -> dict:
     if not raw_key:
         return None
 
-    document = db.api_keys.find_one({"key_hash": hash_key(raw_key), "revoked_at": None})
+    key_hash = hash_key(raw_key)
+    document, generation = lookup("key", key_hash)
 
-    if not document:
-        raise HTTPException(status_code=401, detail="Invalid API key")
+    if document is None:
+        document = db.api_keys.find_one({"key_hash": key_hash, "revoked_at": None})
+
+        if not document:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+
+        store("key", key_hash, document, generation)
 
     enforce("api_key", str(document["_id"]), API_RATE_LIMIT, API_RATE_WINDOW)
 
-    db.api_keys.update_one({"_id": document["_id"]}, {"$set": {"last_used_at": datetime.now(timezone.utc)}})
+    touch_key(str(document["_id"]))
+
+    return document
+
+
+async def resolve_api_key_async(request: Request, db) -> dict:
+    raw_key = (request.headers.get("x-api-key") or "").strip()
+
+    if not raw_key:
+        return None
+
+    key_hash = hash_key(raw_key)
+    document, generation = lookup("key", key_hash)
+
+    if document is None:
+        document = await db.api_keys.find_one({"key_hash": key_hash, "revoked_at": None})
+
+        if not document:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+
+        store("key", key_hash, document, generation)
+
+    await enforce_async("api_key", str(document["_id"]), API_RATE_LIMIT, API_RATE_WINDOW)
+
+    touch_key(str(document["_id"]))
 
     return document
 
@@ -130,14 +162,18 @@ def revoke_key(key_id: str, db=Depends(get_db), token_doc=Depends(current_user),
     except (InvalidId, TypeError):
         raise HTTPException(status_code=400, detail="Invalid key id")
 
-    result = db.api_keys.update_one(
+    revoked = db.api_keys.find_one_and_update(
         {"_id": object_id, "user_id": token_doc["user_id"], "revoked_at": None},
-        {"$set": {"revoked_at": datetime.now(timezone.utc)}}
+        {"$set": {"revoked_at": datetime.now(timezone.utc)}},
+        projection={"key_hash": 1},
+        return_document=ReturnDocument.AFTER,
     )
 
-    if not result.matched_count:
+    if not revoked:
         raise HTTPException(status_code=404, detail="Key not found")
 
+    revoke("key", revoked["key_hash"])
+
     system_log(db, "api_key.revoked", user_id=token_doc["user_id"], request_info=req_info)
 
     return {"revoked": True}
@@ -4,6 +4,7 @@ from bson import ObjectId
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 
+from src.api.auth_cache import revoke, token_id
 from src.api.functions import get_request_info, hash_password, system_log, verify_password, utc_tomorrow_start, is_valid_email
 from src.api.rate_limit import enforce
 from src.api.schema import UserRegister
@@ -129,6 +130,7 @@ def me(db=Depends(get_db), token_doc=Depends(current_user)):
 @router.post("/logout", summary="Logout a user")
 def logout(db=Depends(get_db), token_doc=Depends(current_user), req_info=Depends(get_request_info)):
     db.tokens.delete_one({"token": token_doc["token"]})
+    revoke("token", token_id(token_doc["token"]))
 
     system_log(db, "logout", user_id=token_doc["user_id"], request_info=req_info)
 
@@ -0,0 +1,137 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from src.config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL, AUTH_TOUCH_INTERVAL
+from src.db.cache import AUTH_REVOKED_CHANNEL, get_cache
+from src.db.db import get_db
+
+_entries = OrderedDict()
+_touched = {}
+_lock = threading.Lock()
+_state = {"pid": None, "live": False, "generation": 0}
+
+
+def token_id(token: str) -> str:
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()
+
+
+def forget(kind: str, ident: str):
+    with _lock:
+        _entries.pop((kind, ident), None)
+        _state["generation"] += 1
+
+
+def listen():
+    while True:
+        pubsub = get_cache().pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(AUTH_REVOKED_CHANNEL)
+            with _lock:
+                _entries.clear()
+                _state["live"] = True
+
+            for message in pubsub.listen():
+                if message.get("type") == "message":
+                    kind, _, ident = message["data"].partition(":")
+                    forget(kind, ident)
+        except Exception as e:
+            print("oturum iptal aboneligi koptu:", repr(e), flush=True)
+        finally:
+            with _lock:
+                _state["live"] = False
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+        time.sleep(1)
+
+
+def flush_touches():
+    with _lock:
+        touched = dict(_touched)
+        _touched.clear()
+
+    if not touched:
+        return
+
+    try:
+        get_db().api_keys.bulk_write(
+            [UpdateOne({"_id": ObjectId(key_id)}, {"$max": {"last_used_at": at}}) for key_id, at in touched.items()],
+            ordered=False,
+        )
+    except Exception as e:
+        print("anahtar kullanimi yazilamadi:", len(touched), repr(e), flush=True)
+
+
+def flush_forever():
+    while True:
+        time.sleep(AUTH_TOUCH_INTERVAL)
+        flush_touches()
+
+
+def start():
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return
+        _entries.clear()
+        _touched.clear()
+        _state.update(pid=os.getpid(), live=False)
+
+    threading.Thread(target=listen, name="auth-revocations", daemon=True).start()
+    threading.Thread(target=flush_forever, name="auth-touches", daemon=True).start()
+    atexit.register(flush_touches)
+
+
+def lookup(kind: str, ident: str):
+    start()
+
+    with _lock:
+        generation = _state["generation"]
+        if not _state["live"] or AUTH_CACHE_TTL <= 0:
+            return None, generation
+
+        entry = _entries.get((kind, ident))
+        if entry is None:
+            return None, generation
+        if entry[0] <= time.monotonic():
+            del _entries[(kind, ident)]
+            return None, generation
+
+        _entries.move_to_end((kind, ident))
+        return entry[1], generation
+
+
+def store(kind: str, ident: str, document: dict, generation: int):
+    with _lock:
+        if not _state["live"] or _state["generation"] != generation or AUTH_CACHE_TTL <= 0:
+            return
+
+        _entries[(kind, ident)] = (time.monotonic() + AUTH_CACHE_TTL, document)
+        _entries.move_to_end((kind, ident))
+        while len(_entries) > AUTH_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def revoke(kind: str, ident: str):
+    forget(kind, ident)
+
+    try:
+        get_cache().publish(AUTH_REVOKED_CHANNEL, f"{kind}:{ident}")
+    except Exception as e:
+        print("oturum iptali yayinlanamadi:", kind, repr(e), flush=True)
+
+
+def touch_key(key_id: str):
+    start()
+
+    with _lock:
+        _touched[key_id] = datetime.now(timezone.utc)
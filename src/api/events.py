@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from src.api.functions import get_request_info
+from src.api.rate_limit import enforce_async
+from src.config import CHECK_RATE_LIMIT, CHECK_RATE_WINDOW, STREAM_HEARTBEAT, TEST_ADDRESS_TTL_MINUTES
+from src.db.cache import EVENTS_PREFIX, get_async_cache, read_status_async
+
+router = APIRouter()
+
+QUEUE_SIZE = 16
+TERMINAL = ("analyzed",)
+
+
+class Broadcaster:
+
+    def __init__(self):
+        self.listeners = {}
+        self.task = None
+        self.subscribed = asyncio.Event()
+
+    def join(self, to_address: str) -> asyncio.Queue:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.listeners.setdefault(to_address, set()).add(queue)
+        return queue
+
+    def leave(self, to_address: str, queue: asyncio.Queue):
+        queues = self.listeners.get(to_address)
+        if queues is None:
+            return
+
+        queues.discard(queue)
+        if not queues:
+            del self.listeners[to_address]
+
+    def deliver(self, to_address: str, data: str):
+        for queue in list(self.listeners.get(to_address, ())):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    async def run(self):
+        while True:
+            pubsub = get_async_cache().pubsub()
+            try:
+                await pubsub.psubscribe(EVENTS_PREFIX + "*")
+                self.subscribed.set()
+                async for message in pubsub.listen():
+                    if message.get("type") == "pmessage":
+                        self.deliver(message["channel"][len(EVENTS_PREFIX):], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("olay aboneligi koptu:", repr(e), flush=True)
+                await asyncio.sleep(1)
+            finally:
+                self.subscribed.clear()
+                await pubsub.aclose()
+
+
+broadcaster = Broadcaster()
+
+
+def sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def finishes(state: dict, after: str) -> bool:
+    return state.get("status") in TERMINAL and (state.get("event_id") or "").lower() > (after or "")
+
+
+@router.get("/stream/{to_address}", tags=["test"], summary="Server-Sent Events for every state change of an address")
+async def stream_address(to_address: str, request: Request, after: str = None, req_info=Depends(get_request_info)):
+    await enforce_async("check", req_info.get("ip"), CHECK_RATE_LIMIT, CHECK_RATE_WINDOW)
+
+    if after and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid event id")
+    after = after.lower() if after else None
+
+    address = to_address.strip().lower()
+    queue = broadcaster.join(address)
+
+    async def body():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TEST_ADDRESS_TTL_MINUTES * 60
+
+        try:
+            yield sse("ready", json.dumps({"address": address}))
+
+            try:
+                await asyncio.wait_for(broadcaster.subscribed.wait(), timeout=STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                pass
+
+            state = await read_status_async(address)
+            if state:
+                yield sse("status", json.dumps(state))
+                if after and finishes(state, after):
+                    yield sse("done", json.dumps(state))
+                    return
+
+            while loop.time() < deadline and not await request.is_disconnected():
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+
+                yield sse("status", data)
+                if finishes(json.loads(data), after):
+                    yield sse("done", data)
+                    return
+        finally:
+            broadcaster.leave(address, queue)
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
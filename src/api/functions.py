@@ -7,8 +7,9 @@ from fastapi import Request, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.handlers.sha2_crypt import sha256_crypt
 
-from src.api.token import current_user
-from src.db.db import get_db
+from src.api import log_sink
+from src.api.token import current_user, current_user_async
+from src.db.db import get_async_db, get_db
 
 
 def system_log(db, event: str, level: str = "INFO", user_id=None, session_id: str = None, request_info: dict = None, payload: dict = None, error: str = None):
@@ -35,7 +36,7 @@ def system_log(db, event: str, level: str = "INFO", user_id=None, session_id: st
         log_doc["ip"] = request_info.get("ip")
         log_doc["user_agent"] = request_info.get("user_agent")
 
-    return db.system_logs.insert_one(log_doc)
+    log_sink.emit(log_doc)
 
 
 def get_request_info(request: Request):
@@ -80,6 +81,20 @@ def optional_current_user(request: Request, token: str = Depends(oauth2_optional
     return current_user(token=token, db=db)
 
 
+async def optional_current_user_async(request: Request, token: str = Depends(oauth2_optional),
+                                      db=Depends(get_async_db)):
+    from src.api.api_keys import resolve_api_key_async
+
+    api_key = await resolve_api_key_async(request, db)
+    if api_key:
+        return {"user_id": api_key["user_id"], "api_key_id": str(api_key["_id"])}
+
+    if not token:
+        return None
+
+    return await current_user_async(token=token, db=db)
+
+
 def utc_tomorrow_start(current_time: datetime | None = None) -> datetime:
     if current_time is None:
         current_time = datetime.now(timezone.utc)
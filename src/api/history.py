@@ -1,11 +1,12 @@
 from bson import ObjectId
 from bson.errors import InvalidId
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 
-from src.api.functions import get_request_info, optional_current_user
-from src.api.rate_limit import enforce
+from src.api.functions import get_request_info, optional_current_user_async
+from src.api.rate_limit import enforce_async
 from src.config import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, READ_RATE_LIMIT, READ_RATE_WINDOW
-from src.db.db import get_db
+from src.db.db import get_async_db
+from src.db.reports import analyzed_body, load_report_async, store_report_async
 
 router = APIRouter()
 
@@ -45,10 +46,10 @@ def summary_view(document: dict) -> dict:
 
 
 @router.get("/history", tags=["history"], summary="Past reports of the current user")
-def list_history(limit: int = HISTORY_PAGE_SIZE, before: str = None, db=Depends(get_db),
-                 req_info=Depends(get_request_info), current_user=Depends(optional_current_user)):
+async def list_history(limit: int = HISTORY_PAGE_SIZE, before: str = None, db=Depends(get_async_db),
+                       req_info=Depends(get_request_info), current_user=Depends(optional_current_user_async)):
     user_id = require_user(current_user)
-    enforce("history", user_id, READ_RATE_LIMIT, READ_RATE_WINDOW)
+    await enforce_async("history", user_id, READ_RATE_LIMIT, READ_RATE_WINDOW)
 
     page_size = max(1, min(int(limit or HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
     query = {"owner.user_id": user_id}
@@ -59,7 +60,7 @@ def list_history(limit: int = HISTORY_PAGE_SIZE, before: str = None, db=Depends(
         except (InvalidId, TypeError):
             raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    documents = list(db.analyses.find(query, SUMMARY_FIELDS).sort("_id", -1).limit(page_size + 1))
+    documents = await db.analyses.find(query, SUMMARY_FIELDS).sort("_id", -1).limit(page_size + 1).to_list()
     has_more = len(documents) > page_size
     documents = documents[:page_size]
 
@@ -70,21 +71,26 @@ def list_history(limit: int = HISTORY_PAGE_SIZE, before: str = None, db=Depends(
 
 
 @router.get("/history/{report_id}", tags=["history"], summary="One past report in full")
-def get_report(report_id: str, db=Depends(get_db), req_info=Depends(get_request_info),
-               current_user=Depends(optional_current_user)):
+async def get_report(report_id: str, db=Depends(get_async_db), req_info=Depends(get_request_info),
+                     current_user=Depends(optional_current_user_async)):
     user_id = require_user(current_user)
-    enforce("history", user_id, READ_RATE_LIMIT, READ_RATE_WINDOW)
+    await enforce_async("history", user_id, READ_RATE_LIMIT, READ_RATE_WINDOW)
 
     try:
         object_id = ObjectId(report_id)
     except (InvalidId, TypeError):
         raise HTTPException(status_code=400, detail="Invalid report id")
 
-    document = db.analyses.find_one({"_id": object_id, "owner.user_id": user_id})
+    cached = await load_report_async(report_id)
+    if cached and cached[0] == user_id:
+        return Response(content=analyzed_body(cached[1]), media_type="application/json")
+
+    document = await db.analyses.find_one({"_id": object_id, "owner.user_id": user_id})
 
     if not document:
         raise HTTPException(status_code=404, detail="Report not found")
 
     document["_id"] = str(document["_id"])
+    await store_report_async(document)
 
     return {"status": "analyzed", "result": document}
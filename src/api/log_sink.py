@@ -0,0 +1,168 @@
+import fcntl
+import os
+import queue
+import threading
+import time
+
+import pymongo
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+from src.config import LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_QUEUE_SIZE, LOG_REPLAY_INTERVAL, LOG_SPOOL_PATH
+from src.config import LOG_WRITE_TIMEOUT
+from src.db.db import get_db
+
+STOP = object()
+
+_queue = queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE))
+_lock = threading.Lock()
+_state = {"pid": None, "thread": None, "dropped": 0, "reported": 0, "written": 0, "spooled": 0,
+          "replay_at": 0.0, "replay_backoff": 0.0}
+
+
+def count(name: str, amount: int = 1):
+    with _lock:
+        _state[name] += amount
+
+
+def stats() -> dict:
+    with _lock:
+        return {k: _state[k] for k in ("dropped", "written", "spooled")} | {"queued": _queue.qsize()}
+
+
+def spool(batch: list) -> bool:
+    if not LOG_SPOOL_PATH:
+        return False
+
+    try:
+        with open(LOG_SPOOL_PATH, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write("".join(json_util.dumps(doc) + "\n" for doc in batch))
+    except Exception as e:
+        print("log diske yazilamadi:", LOG_SPOOL_PATH, repr(e), flush=True)
+        return False
+
+    count("spooled", len(batch))
+    return True
+
+
+def insert_once(docs: list):
+    try:
+        get_db().system_logs.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(error.get("code") != 11000 for error in errors):
+            raise
+
+
+def replay():
+    if not LOG_SPOOL_PATH or not os.path.isfile(LOG_SPOOL_PATH) or not os.path.getsize(LOG_SPOOL_PATH):
+        return
+
+    with open(LOG_SPOOL_PATH, "r+", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        batch = []
+
+        for line in f:
+            if line.strip():
+                batch.append(json_util.loads(line))
+            if len(batch) >= LOG_BATCH_SIZE:
+                insert_once(batch)
+                batch = []
+
+        if batch:
+            insert_once(batch)
+
+        f.truncate(0)
+
+
+def replay_due():
+    if time.monotonic() < _state["replay_at"]:
+        return
+
+    try:
+        with pymongo.timeout(LOG_WRITE_TIMEOUT * 10):
+            replay()
+        _state["replay_backoff"] = 0.0
+    except Exception as e:
+        print("diskteki loglar aktarilamadi:", repr(e), flush=True)
+        _state["replay_backoff"] = min(max(LOG_REPLAY_INTERVAL, _state["replay_backoff"] * 2), LOG_REPLAY_INTERVAL * 32)
+
+    _state["replay_at"] = time.monotonic() + max(LOG_REPLAY_INTERVAL, _state["replay_backoff"])
+
+
+def write(batch: list):
+    try:
+        with pymongo.timeout(LOG_WRITE_TIMEOUT):
+            insert_once(batch)
+        count("written", len(batch))
+    except Exception as e:
+        print("log yazilamadi:", len(batch), repr(e), flush=True)
+        if not spool(batch):
+            count("dropped", len(batch))
+        return
+
+    with _lock:
+        dropped = _state["dropped"] - _state["reported"]
+        _state["reported"] = _state["dropped"]
+
+    if dropped:
+        print("log kuyrugu doldu, atilan kayit:", dropped, flush=True)
+
+
+def drain():
+    while True:
+        try:
+            first = _queue.get(timeout=LOG_FLUSH_INTERVAL)
+        except queue.Empty:
+            replay_due()
+            continue
+
+        batch = [] if first is STOP else [first]
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        stopping = first is STOP
+
+        while not stopping and len(batch) < LOG_BATCH_SIZE:
+            try:
+                item = _queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is STOP:
+                stopping = True
+            else:
+                batch.append(item)
+
+        if batch:
+            write(batch)
+            replay_due()
+
+        if stopping:
+            return
+
+
+def start():
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return
+        _state["pid"] = os.getpid()
+        _state["thread"] = threading.Thread(target=drain, name="system-log", daemon=True)
+        _state["thread"].start()
+
+
+def emit(log_doc: dict):
+    start()
+
+    try:
+        _queue.put_nowait(log_doc)
+    except queue.Full:
+        count("dropped")
+
+
+def close(timeout: float = 10.0):
+    thread = _state["thread"]
+    if thread is None or _state["pid"] != os.getpid() or not thread.is_alive():
+        return
+
+    _queue.put(STOP)
+    thread.join(timeout)
+    print("system log:", stats(), flush=True)
@@ -1,17 +1,21 @@
+import asyncio
 from datetime import datetime, timezone, timedelta
 
 from bson import ObjectId
 from bson.errors import InvalidId
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 
-from src.api.functions import get_request_info, optional_current_user
-from src.api.rate_limit import enforce
+from src.api.functions import get_request_info, optional_current_user_async
+from src.api.rate_limit import enforce_async
 from src.config import GENERATE_RATE_LIMIT, GENERATE_RATE_WINDOW, TEST_ADDRESS_TTL_MINUTES
 from src.config import CHECK_RATE_LIMIT, CHECK_RATE_WINDOW, READ_RATE_LIMIT, READ_RATE_WINDOW
-from src.db.cache import address_key, get_cache
-from src.db.db import get_db
+from src.db.cache import RECIPIENTS_CHANNEL, REVOKED_ADDRESSES_KEY, address_key, get_async_cache, read_status_async
+from src.db.cache import recipient_update
+from src.db.cache import save_status_async, status_order
+from src.db.db import get_async_db
+from src.db.reports import analyzed_body, load_report_async, store_report_async
 from src.processor.generator import generate_random_email
-from src.worker.limits import get_quota_state
+from src.worker.limits import get_quota_state_async
 
 router = APIRouter()
 
@@ -34,8 +38,8 @@ def quota_payload(quota: dict) -> dict:
     }
 
 
-def address_is_live(db, to_address: str) -> bool:
-    test_email = db.test_emails.find_one({"to_address": to_address}, {"expires_at": 1})
+async def address_is_live(db, to_address: str) -> bool:
+    test_email = await db.test_emails.find_one({"to_address": to_address}, {"expires_at": 1})
 
     if not test_email:
         return False
@@ -47,7 +51,7 @@ def address_is_live(db, to_address: str) -> bool:
     return bool(expires_at and expires_at > datetime.now(timezone.utc))
 
 
-def newest_event(db, to_address: str, after: str = None) -> dict:
+async def newest_event(db, to_address: str, after: str = None) -> dict:
     query = {"to_address": to_address}
 
     if after:
@@ -56,37 +60,63 @@ def newest_event(db, to_address: str, after: str = None) -> dict:
         except (InvalidId, TypeError):
             raise HTTPException(status_code=400, detail="Invalid event id")
 
-    return db.mail_events.find_one(query, sort=[("_id", -1)])
+    return await db.mail_events.find_one(query, sort=[("_id", -1)])
 
 
-def read_analysis(db, analysis_id: str) -> dict:
-    analysis = db.analyses.find_one({"_id": ObjectId(analysis_id)})
+async def read_analysis(db, analysis_id: str) -> dict:
+    analysis = await db.analyses.find_one({"_id": ObjectId(analysis_id)})
     if not analysis:
         return None
     analysis["_id"] = str(analysis["_id"])
+    await store_report_async(analysis)
     return analysis
 
 
+async def cached_analysis(analysis_id: str, event_id: str = None):
+    cached = await load_report_async(analysis_id) if analysis_id else None
+    if not cached:
+        return None
+    return Response(content=analyzed_body(cached[1], event_id), media_type="application/json")
+
+
+async def cached_check(state: dict, after: str = None):
+    event_id = state.get("event_id")
+
+    if not event_id or (after and (not ObjectId.is_valid(after) or event_id <= after.lower())):
+        return None
+
+    if state.get("status") == "processing":
+        return {"status": "processing", "event_id": event_id}
+
+    if state.get("status") == "analyzed":
+        return await cached_analysis(state.get("analysis_id"), event_id)
+
+    return None
+
+
 @router.get("/limits", tags=["test"])
-def get_limits(db=Depends(get_db), req_info=Depends(get_request_info), current_user=Depends(optional_current_user)):
-    quota = get_quota_state(db, owner_of(current_user), req_info.get("ip"), key_of(current_user))
+async def get_limits(db=Depends(get_async_db), req_info=Depends(get_request_info),
+                     current_user=Depends(optional_current_user_async)):
+    quota = await get_quota_state_async(db, owner_of(current_user), req_info.get("ip"), key_of(current_user))
     payload = quota_payload(quota)
     payload["address_ttl_seconds"] = TEST_ADDRESS_TTL_MINUTES * 60
     return payload
 
 
 @router.post("/generate", tags=["test"])
-def generate_random(db=Depends(get_db), req_info=Depends(get_request_info), current_user=Depends(optional_current_user)):
+async def generate_random(db=Depends(get_async_db), req_info=Depends(get_request_info),
+                          current_user=Depends(optional_current_user_async)):
     created_ip = req_info.get("ip")
     owner_user_id = owner_of(current_user)
     api_key_id = key_of(current_user)
 
-    enforce("generate", api_key_id or owner_user_id or created_ip, GENERATE_RATE_LIMIT, GENERATE_RATE_WINDOW)
+    await enforce_async("generate", api_key_id or owner_user_id or created_ip, GENERATE_RATE_LIMIT, GENERATE_RATE_WINDOW)
 
-    quota = get_quota_state(db, owner_user_id, created_ip, api_key_id)
+    quota = await get_quota_state_async(db, owner_user_id, created_ip, api_key_id)
 
     now = datetime.now(timezone.utc)
-    to_address = generate_random_email()
+    expires_at = now + timedelta(minutes=TEST_ADDRESS_TTL_MINUTES)
+    to_address = generate_random_email(expires_at)
 
     previous = {"expires_at": {"$gt": now}}
     if owner_user_id:
@@ -94,16 +124,20 @@ def generate_random(db=Depends(get_db), req_info=Depends(get_request_info), curr
     else:
         previous["created_ip"] = created_ip
 
-    cache = get_cache()
-
-    for old in db.test_emails.find(previous, {"to_address": 1}):
-        cache.delete(address_key(old["to_address"]))
+    cache = get_async_cache()
 
-    db.test_emails.update_many(previous, {"$set": {"status": "expired"}, "$unset": {"expires_at": ""}})
+    stale = [old["to_address"] async for old in db.test_emails.find(previous, {"to_address": 1})]
+    if stale:
+        pipe = cache.pipeline(transaction=False)
+        pipe.delete(*[address_key(address) for address in stale])
+        pipe.zadd(REVOKED_ADDRESSES_KEY, {address: expires_at.timestamp() for address in stale})
+        pipe.zremrangebyscore(REVOKED_ADDRESSES_KEY, 0, now.timestamp())
+        pipe.publish(RECIPIENTS_CHANNEL, recipient_update(removed=stale))
+        await pipe.execute()
 
-    expires_at = now + timedelta(minutes=TEST_ADDRESS_TTL_MINUTES)
+    await db.test_emails.update_many(previous, {"$set": {"status": "expired"}, "$unset": {"expires_at": ""}})
 
-    db.test_emails.insert_one({
+    await db.test_emails.insert_one({
         "to_address": to_address,
         "status": "pending",
         "created_at": now,
@@ -119,7 +153,10 @@ def generate_random(db=Depends(get_db), req_info=Depends(get_request_info), curr
         "last_error": None,
     })
 
-    cache.set(address_key(to_address), "1", ex=TEST_ADDRESS_TTL_MINUTES * 60)
+    pipe = cache.pipeline(transaction=False)
+    pipe.set(address_key(to_address), "1", ex=TEST_ADDRESS_TTL_MINUTES * 60)
+    pipe.publish(RECIPIENTS_CHANNEL, recipient_update(added={to_address: expires_at.timestamp()}))
+    await pipe.execute()
 
     return {
         "address": to_address,
@@ -131,26 +168,37 @@ def generate_random(db=Depends(get_db), req_info=Depends(get_request_info), curr
 
 
 @router.get("/check/{to_address}", tags=["test"])
-def check_address(to_address: str, after: str = None, db=Depends(get_db), req_info=Depends(get_request_info)):
-    enforce("check", req_info.get("ip"), CHECK_RATE_LIMIT, CHECK_RATE_WINDOW)
+async def check_address(to_address: str, after: str = None, db=Depends(get_async_db),
+                        req_info=Depends(get_request_info)):
+    await enforce_async("check", req_info.get("ip"), CHECK_RATE_LIMIT, CHECK_RATE_WINDOW)
+
+    state = await read_status_async(to_address)
+    cached = await cached_check(state, after)
+    if cached is not None:
+        return cached
 
-    event = newest_event(db, to_address, after)
+    event = await newest_event(db, to_address, after)
 
     if not event:
-        if address_is_live(db, to_address):
+        if await address_is_live(db, to_address):
             return {"status": "waiting"}
         return {"status": "expired"}
 
     event_id = str(event["_id"])
 
     if event.get("analysis_id"):
-        analysis = read_analysis(db, event["analysis_id"])
+        analysis = await read_analysis(db, event["analysis_id"])
         if analysis:
+            if state.get("event_id") != event_id:
+                await save_status_async(to_address, {"status": "analyzed", "event_id": event_id,
+                                                     "received_at": event.get("received_at"),
+                                                     "analysis_id": analysis["_id"], "analyzed_event_id": event_id},
+                                        publish=False, order=status_order(event_id, event.get("received_at")))
             return {"status": "analyzed", "event_id": event_id, "result": analysis}
         return {"status": "error", "event_id": event_id, "detail": "analysis missing"}
 
     if event.get("last_error") == "daily_analyze_limit_exceeded":
-        quota = get_quota_state(
+        quota = await get_quota_state_async(
             db,
             owner_user_id=event.get("owner_user_id"),
             client_ip=event.get("created_ip"),
@@ -160,7 +208,7 @@ def check_address(to_address: str, after: str = None, db=Depends(get_db), req_in
         if quota["remaining"] <= 0:
             return {"status": "limit", "event_id": event_id}
 
-        db.mail_events.update_one({"_id": event["_id"]}, {"$set": {"last_error": None}})
+        await db.mail_events.update_one({"_id": event["_id"]}, {"$set": {"last_error": None}})
         event["last_error"] = None
 
     if event.get("last_error"):
@@ -168,27 +216,35 @@ def check_address(to_address: str, after: str = None, db=Depends(get_db), req_in
 
     if not event.get("analysis_started_at"):
         from src.worker.tasks import analyze_received_mail
-        analyze_received_mail.delay(event_id)
+        await asyncio.to_thread(analyze_received_mail.delay, event_id)
 
     return {"status": "processing", "event_id": event_id}
 
 
 @router.get("/result/{to_address}", tags=["test"])
-def get_result(to_address: str, db=Depends(get_db), req_info=Depends(get_request_info)):
-    enforce("result", req_info.get("ip"), READ_RATE_LIMIT, READ_RATE_WINDOW)
+async def get_result(to_address: str, db=Depends(get_async_db), req_info=Depends(get_request_info)):
+    await enforce_async("result", req_info.get("ip"), READ_RATE_LIMIT, READ_RATE_WINDOW)
 
-    event = db.mail_events.find_one(
+    state = await read_status_async(to_address)
+    cached = await cached_analysis(state.get("analysis_id"), state.get("analyzed_event_id"))
+    if cached is not None:
+        return cached
+
+    event = await db.mail_events.find_one(
         {"to_address": to_address, "analysis_id": {"$ne": None}},
         sort=[("_id", -1)]
     )
 
     if not event:
-        if address_is_live(db, to_address):
+        if await address_is_live(db, to_address):
             return {"status": "waiting"}
         return {"status": "expired"}
 
-    analysis = read_analysis(db, event["analysis_id"])
+    analysis = await read_analysis(db, event["analysis_id"])
     if not analysis:
         return {"status": "error", "detail": "analysis missing"}
 
+    await save_status_async(to_address, {"analysis_id": analysis["_id"], "analyzed_event_id": str(event["_id"])},
+                            publish=False, order=status_order(str(event["_id"]), event.get("received_at")))
+
     return {"status": "analyzed", "event_id": str(event["_id"]), "result": analysis}
@@ -6,7 +6,7 @@ from fastapi.staticfiles import StaticFiles
 from starlette.exceptions import HTTPException
 from starlette.middleware.cors import CORSMiddleware
 
-from src.api import api_keys, auth, history, mail_tests
+from src.api import admin, api_keys, auth, events, history, log_sink, mail_tests
 
 WEB_ROOT = os.getenv("WEB_ROOT", "public")
 BLOCKED_WEB_SUFFIXES = (".md", ".yml", ".yaml", ".toml", ".ini", ".log", ".bak", ".sql")
@@ -59,15 +59,22 @@ async def swagger():
     )
 
 
+@app.on_event("shutdown")
+def flush_logs():
+    log_sink.close()
+
+
 @app.get("/health", tags=["health"])
 def health():
     return {"status": "ok", "web": os.path.isfile(os.path.join(WEB_ROOT, "index.html"))}
 
 
 app.include_router(mail_tests.router)
+app.include_router(events.router)
 app.include_router(auth.router)
 app.include_router(api_keys.router)
 app.include_router(history.router)
+app.include_router(admin.router)
 
 if os.path.isfile(os.path.join(WEB_ROOT, "index.html")):
     app.mount("/", WebFiles(directory=WEB_ROOT, html=True), name="web")
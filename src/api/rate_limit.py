@@ -1,42 +1,158 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
 from fastapi import HTTPException
 
-from src.db.cache import get_cache
+from src.config import RATE_LIMIT_LOCAL_SIZE, RATE_LIMIT_RETRY
+from src.db.cache import get_async_cache, get_cache
 
+GCRA_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local next_tat = tat + interval
+if next_tat - window > now then
+    return {0, tat - now, next_tat - window - now}
+end
+redis.call('SET', KEYS[1], next_tat, 'PX', next_tat - now)
+return {1, next_tat - now, 0}
+"""
+
+_lock = threading.Lock()
+_denied = OrderedDict()
+_local = OrderedDict()
+_redis = {"down_until": 0.0}
+
+
+def remember(table: OrderedDict, key: str, value: float):
+    table[key] = value
+    table.move_to_end(key)
+    while len(table) > RATE_LIMIT_LOCAL_SIZE:
+        table.popitem(last=False)
+
+
+def local_gcra(key: str, interval: int, window: int, now_ms: int) -> tuple:
+    with _lock:
+        tat = max(_local.get(key, now_ms), now_ms)
+        next_tat = tat + interval
+
+        if next_tat - window > now_ms:
+            return False, tat - now_ms, next_tat - window - now_ms
+
+        remember(_local, key, next_tat)
+        return True, next_tat - now_ms, 0
+
+
+def redis_gcra(key: str, interval: int, window: int) -> tuple:
+    script = get_cache().register_script(GCRA_SCRIPT)
+    allowed, backlog, wait = script(keys=[key], args=[interval, window])
+    return allowed == 1, int(backlog), int(wait)
+
+
+async def redis_gcra_async(key: str, interval: int, window: int) -> tuple:
+    script = get_async_cache().register_script(GCRA_SCRIPT)
+    allowed, backlog, wait = await script(keys=[key], args=[interval, window])
+    return allowed == 1, int(backlog), int(wait)
+
+
+def plan(scope: str, identity: str, limit: int, window: int) -> tuple:
+    limit = max(1, limit)
+    window_ms = max(1, window) * 1000
+    return f"mailtester:rate:{scope}:{identity}", limit, window_ms, max(1, window_ms // limit)
+
+
+def known_denied(key: str, limit: int, now: float) -> dict:
+    with _lock:
+        denied_until = _denied.get(key, 0.0)
+
+    if denied_until > now:
+        return {"allowed": False, "used": limit + 1, "limit": limit,
+                "retry_after": math.ceil(denied_until - now)}
+
+    return None
+
+
+def redis_failed(scope: str, identity: str, error: Exception, now: float):
+    print("rate limit sayaci okunamadi:", scope, identity, repr(error), flush=True)
+    _redis["down_until"] = now + RATE_LIMIT_RETRY
 
-def hit(scope: str, identity: str, limit: int, window: int) -> dict:
-    key = f"mailtester:rate:{scope}:{identity}"
-    cache = get_cache()
-
-    try:
-        pipe = cache.pipeline()
-        pipe.incr(key)
-        pipe.ttl(key)
-        used, ttl = pipe.execute()
-    except Exception as e:
-        print("rate limit sayaci okunamadi:", scope, identity, repr(e), flush=True)
-        return {"allowed": True, "used": 0, "limit": limit, "retry_after": 0}
-
-    if used == 1 or ttl is None or ttl < 0:
-        try:
-            cache.expire(key, window)
-        except Exception:
-            pass
-        ttl = window
+
+def verdict(key: str, limit: int, interval: int, decision: tuple, now: float) -> dict:
+    allowed, backlog, wait = decision
+
+    if not allowed:
+        with _lock:
+            remember(_denied, key, now + wait / 1000.0)
 
     return {
-        "allowed": used <= limit,
-        "used": int(used),
+        "allowed": allowed,
+        "used": min(limit + 1, math.ceil(backlog / interval)) if allowed else limit + 1,
         "limit": limit,
-        "retry_after": int(ttl),
+        "retry_after": math.ceil(wait / 1000.0),
     }
 
 
-def enforce(scope: str, identity: str, limit: int, window: int) -> None:
-    result = hit(scope, identity, limit, window)
+def hit(scope: str, identity: str, limit: int, window: int) -> dict:
+    key, limit, window_ms, interval = plan(scope, identity, limit, window)
+    now = time.monotonic()
+
+    denied = known_denied(key, limit, now)
+    if denied:
+        return denied
+
+    decision = None
+    if _redis["down_until"] <= now:
+        try:
+            decision = redis_gcra(key, interval, window_ms)
+        except Exception as e:
+            redis_failed(scope, identity, e, now)
+
+    if decision is None:
+        decision = local_gcra(key, interval, window_ms, int(time.time() * 1000))
+
+    return verdict(key, limit, interval, decision, now)
+
+
+async def hit_async(scope: str, identity: str, limit: int, window: int) -> dict:
+    key, limit, window_ms, interval = plan(scope, identity, limit, window)
+    now = time.monotonic()
 
+    denied = known_denied(key, limit, now)
+    if denied:
+        return denied
+
+    decision = None
+    if _redis["down_until"] <= now:
+        try:
+            decision = await redis_gcra_async(key, interval, window_ms)
+        except Exception as e:
+            redis_failed(scope, identity, e, now)
+
+    if decision is None:
+        decision = local_gcra(key, interval, window_ms, int(time.time() * 1000))
+
+    return verdict(key, limit, interval, decision, now)
+
+
+def reject(result: dict) -> None:
     if not result["allowed"]:
         raise HTTPException(
             status_code=429,
             detail="Too many requests, try again later",
             headers={"Retry-After": str(result["retry_after"])},
         )
+
+
+def enforce(scope: str, identity: str, limit: int, window: int) -> None:
+    reject(hit(scope, identity, limit, window))
+
+
+async def enforce_async(scope: str, identity: str, limit: int, window: int) -> None:
+    reject(await hit_async(scope, identity, limit, window))
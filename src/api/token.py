@@ -4,9 +4,10 @@ import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+from src.api.auth_cache import lookup, revoke, store, token_id
 from src.api.utils.time import ensure_utc_aware
 from src.config import TOKEN_EXPIRE_MINUTES, SECRET_KEY, ALGORITHM
-from src.db.db import get_db
+from src.db.db import get_async_db, get_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
@@ -25,7 +26,10 @@ def create_access_token(data: dict):
 
 
 def token_save(token: str, user_id: str, expire_at: datetime, db=Depends(get_db)):
-    db.tokens.delete_one({"user_id": user_id})
+    replaced = db.tokens.find_one_and_delete({"user_id": user_id}, projection={"token": 1})
+    if replaced and replaced.get("token"):
+        revoke("token", token_id(replaced["token"]))
+
     now = datetime.now(timezone.utc)
 
     payload = {
@@ -41,11 +45,31 @@ def token_save(token: str, user_id: str, expire_at: datetime, db=Depends(get_db)
 
 
 def check_token(token: str, db):
-    now = datetime.now(timezone.utc)
+    token_doc, generation = lookup("token", token_id(token))
+
+    if token_doc is None:
+        token_doc = db.tokens.find_one({"token": token})
+        if not token_doc:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        store("token", token_id(token), token_doc, generation)
+
+    return valid_token_doc(token_doc)
+
 
-    token_doc = db.tokens.find_one({"token": token})
-    if not token_doc:
-        raise HTTPException(status_code=401, detail="Invalid token")
+async def check_token_async(token: str, db):
+    token_doc, generation = lookup("token", token_id(token))
+
+    if token_doc is None:
+        token_doc = await db.tokens.find_one({"token": token})
+        if not token_doc:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        store("token", token_id(token), token_doc, generation)
+
+    return valid_token_doc(token_doc)
+
+
+def valid_token_doc(token_doc: dict):
+    now = datetime.now(timezone.utc)
 
     expire_at = ensure_utc_aware(token_doc.get("expire_at"))
     if not expire_at:
@@ -57,7 +81,7 @@ def check_token(token: str, db):
     return token_doc
 
 
-def current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
+def token_user_id(token: str) -> str:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
@@ -69,14 +93,26 @@ def current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="user_id not found")
 
-    token_doc = check_token(token=token, db=db)
+    return user_id
 
+
+def token_owned_by(token_doc: dict, user_id: str):
     if token_doc.get("user_id") != user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token user mismatch")
 
     return token_doc
 
 
+def current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)):
+    user_id = token_user_id(token)
+    return token_owned_by(check_token(token=token, db=db), user_id)
+
+
+async def current_user_async(token: str = Depends(oauth2_scheme), db=Depends(get_async_db)):
+    user_id = token_user_id(token)
+    return token_owned_by(await check_token_async(token=token, db=db), user_id)
+
+
 def get_active_or_new_token(user: dict, db=Depends(get_db)):
     user_id = str(user["_id"])
 
@@ -21,10 +21,26 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/2")
 INGEST_LMTP_PORT = int(os.getenv("INGEST_LMTP_PORT", "2400"))
 INGEST_MAP_PORT = int(os.getenv("INGEST_MAP_PORT", "2500"))
 MESSAGE_SIZE_LIMIT = int(os.getenv("MESSAGE_SIZE_LIMIT", "26214400"))
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "261120"))
+INGEST_HEADER_LIMIT = int(os.getenv("INGEST_HEADER_LIMIT", "262144"))
+INGEST_MONGO_TIMEOUT = float(os.getenv("INGEST_MONGO_TIMEOUT", "5.0"))
+INGEST_SPOOL_PATH = (os.getenv("INGEST_SPOOL_PATH") or "").strip()
+SPOOL_DRAIN_INTERVAL = float(os.getenv("SPOOL_DRAIN_INTERVAL", "5"))
+SPOOL_RETRY = float(os.getenv("SPOOL_RETRY", "30"))
+RCPT_NEGATIVE_TTL = float(os.getenv("RCPT_NEGATIVE_TTL", "60"))
+RCPT_NEGATIVE_SIZE = int(os.getenv("RCPT_NEGATIVE_SIZE", "100000"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_QUEUE_SIZE = int(os.getenv("OUTBOX_QUEUE_SIZE", "10000"))
+OUTBOX_SWEEP_INTERVAL = float(os.getenv("OUTBOX_SWEEP_INTERVAL", "15"))
+OUTBOX_SWEEP_AGE = int(os.getenv("OUTBOX_SWEEP_AGE", "30"))
 TEST_ADDRESS_TTL_MINUTES = int(os.getenv("TEST_ADDRESS_TTL_MINUTES", "30"))
+SIGNED_ADDRESSES = (os.getenv("SIGNED_ADDRESSES") or "").strip().lower() in ("1", "true", "yes")
 
 ANON_DAILY_LIMIT = int(os.getenv("ANON_DAILY_LIMIT", "5"))
 USER_DAILY_LIMIT = int(os.getenv("USER_DAILY_LIMIT", "25"))
+QUOTA_FLUSH_DELAY = int(os.getenv("QUOTA_FLUSH_DELAY", "10"))
+DELIVERY_CACHE_TTL = int(os.getenv("DELIVERY_CACHE_TTL", "900"))
+DELIVERY_LOCK_TIMEOUT = int(os.getenv("DELIVERY_LOCK_TIMEOUT", "120"))
 
 GENERATE_RATE_LIMIT = int(os.getenv("GENERATE_RATE_LIMIT", "10"))
 GENERATE_RATE_WINDOW = int(os.getenv("GENERATE_RATE_WINDOW", "60"))
@@ -36,14 +52,26 @@ CHECK_RATE_LIMIT = int(os.getenv("CHECK_RATE_LIMIT", "90"))
 CHECK_RATE_WINDOW = int(os.getenv("CHECK_RATE_WINDOW", "60"))
 READ_RATE_LIMIT = int(os.getenv("READ_RATE_LIMIT", "60"))
 READ_RATE_WINDOW = int(os.getenv("READ_RATE_WINDOW", "60"))
+RATE_LIMIT_LOCAL_SIZE = int(os.getenv("RATE_LIMIT_LOCAL_SIZE", "10000"))
+RATE_LIMIT_RETRY = float(os.getenv("RATE_LIMIT_RETRY", "5"))
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
 
 API_KEY_PREFIX = (os.getenv("API_KEY_PREFIX") or "mt").strip()
 API_KEYS_PER_USER = int(os.getenv("API_KEYS_PER_USER", "5"))
 API_DAILY_LIMIT = int(os.getenv("API_DAILY_LIMIT", "25"))
 API_RATE_LIMIT = int(os.getenv("API_RATE_LIMIT", "120"))
 API_RATE_WINDOW = int(os.getenv("API_RATE_WINDOW", "60"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_TOUCH_INTERVAL = float(os.getenv("AUTH_TOUCH_INTERVAL", "30"))
 HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
 HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_WRITE_TIMEOUT = float(os.getenv("LOG_WRITE_TIMEOUT", "2.0"))
+LOG_SPOOL_PATH = (os.getenv("LOG_SPOOL_PATH") or "").strip()
+LOG_REPLAY_INTERVAL = float(os.getenv("LOG_REPLAY_INTERVAL", "30"))
 
 SPAMD_HOST = os.getenv("SPAMD_HOST", "spamassassin")
 SPAMD_TIMEOUT = float(os.getenv("SPAMD_TIMEOUT", "10.0"))
@@ -53,15 +81,41 @@ SPAM_PENALTY_CAP = float(os.getenv("SPAM_PENALTY_CAP", "5.0"))
 DNS_RESOLVER = (os.getenv("DNS_RESOLVER") or "").strip()
 DNS_TIMEOUT = float(os.getenv("DNS_TIMEOUT", "3.0"))
 DNS_LIFETIME = float(os.getenv("DNS_LIFETIME", "5.0"))
+DNS_MAX_INFLIGHT = int(os.getenv("DNS_MAX_INFLIGHT", "256"))
+DNS_CACHE_SIZE = int(os.getenv("DNS_CACHE_SIZE", "10000"))
+DNS_CACHE_REDIS_SIZE = int(os.getenv("DNS_CACHE_REDIS_SIZE", "200000"))
+DNS_CACHE_MAX_TTL = int(os.getenv("DNS_CACHE_MAX_TTL", "3600"))
+DNS_NEGATIVE_TTL = int(os.getenv("DNS_NEGATIVE_TTL", "300"))
+DNS_CACHE_SNAPSHOT = (os.getenv("DNS_CACHE_SNAPSHOT") or "").strip()
 
 DNSBL_TIMEOUT = float(os.getenv("DNSBL_TIMEOUT", "2.0"))
 DNSBL_LIFETIME = float(os.getenv("DNSBL_LIFETIME", "2.0"))
 DNSBL_MAX_LISTS = int(os.getenv("DNSBL_MAX_LISTS", "20"))
 DNSBL_CONCURRENCY = int(os.getenv("DNSBL_CONCURRENCY", "10"))
+DNSBL_TTL_LISTED = int(os.getenv("DNSBL_TTL_LISTED", "3600"))
+DNSBL_TTL_NOT_LISTED = int(os.getenv("DNSBL_TTL_NOT_LISTED", "1800"))
+DNSBL_TTL_BLOCKED = int(os.getenv("DNSBL_TTL_BLOCKED", "900"))
+DNSBL_TTL_TIMEOUT = int(os.getenv("DNSBL_TTL_TIMEOUT", "120"))
+DNSBL_HEALTH_SAMPLES = int(os.getenv("DNSBL_HEALTH_SAMPLES", "100"))
+DNSBL_HEALTH_REFRESH = float(os.getenv("DNSBL_HEALTH_REFRESH", "30"))
+DNSBL_BREAKER_MIN_SAMPLES = int(os.getenv("DNSBL_BREAKER_MIN_SAMPLES", "20"))
+DNSBL_BREAKER_RATE = float(os.getenv("DNSBL_BREAKER_RATE", "0.8"))
+DNSBL_BREAKER_COOLDOWN = int(os.getenv("DNSBL_BREAKER_COOLDOWN", "900"))
+DNSBL_HEDGE_LISTS = [x.strip() for x in os.getenv("DNSBL_HEDGE_LISTS", "zen.spamhaus.org,dbl.spamhaus.org").split(",") if x.strip()]
+DNSBL_HEDGE_MIN_DELAY = float(os.getenv("DNSBL_HEDGE_MIN_DELAY", "0.3"))
 URIBL_MAX_DOMAINS = int(os.getenv("URIBL_MAX_DOMAINS", "10"))
 
+ANALYZE_CONCURRENCY = int(os.getenv("ANALYZE_CONCURRENCY", "8"))
+
 SPF_TIMEOUT = float(os.getenv("SPF_TIMEOUT", "8.0"))
 DKIM_MIN_KEY_BITS = int(os.getenv("DKIM_MIN_KEY_BITS", "1024"))
+DKIM_MAX_SIGNATURES = int(os.getenv("DKIM_MAX_SIGNATURES", "5"))
+DKIM_KEY_CACHE_SIZE = int(os.getenv("DKIM_KEY_CACHE_SIZE", "10000"))
+PSL_PATH = (os.getenv("PSL_PATH") or "").strip()
+PSL_CACHE_SIZE = int(os.getenv("PSL_CACHE_SIZE", "10000"))
+CONTENT_SCAN_BYTES = int(os.getenv("CONTENT_SCAN_BYTES", "2000000"))
+CONTENT_TEXT_BUDGET = int(os.getenv("CONTENT_TEXT_BUDGET", "200000"))
+CONTENT_LINK_LIMIT = int(os.getenv("CONTENT_LINK_LIMIT", "1000"))
 
 TOKEN_EXPIRE_MINUTES = int(os.getenv("TOKEN_EXPIRE_MINUTES", "1440"))
 SECRET_KEY = os.getenv("SECRET_KEY")
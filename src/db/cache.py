@@ -1,13 +1,167 @@
+import json
+from datetime import timezone
+
 import redis
+import redis.asyncio
 
-from src.config import REDIS_URL
+from src.config import REDIS_URL, TEST_ADDRESS_TTL_MINUTES
 
 client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+raw_client = redis.Redis.from_url(REDIS_URL)
+async_client = redis.asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+async_raw_client = redis.asyncio.Redis.from_url(REDIS_URL)
+
+ADDRESS_PREFIX = "mailtester:rcpt:"
+RECIPIENTS_CHANNEL = "mailtester:rcpt_feed"
+REVOKED_ADDRESSES_KEY = "mailtester:rcpt_revoked"
+EVENTS_PREFIX = "mailtester:events:"
+AUTH_REVOKED_CHANNEL = "mailtester:auth:revoked"
 
 
 def get_cache():
     return client
 
 
+def get_raw_cache():
+    return raw_client
+
+
+def get_async_cache():
+    return async_client
+
+
+def get_async_raw_cache():
+    return async_raw_client
+
+
 def address_key(to_address: str) -> str:
-    return "mailtester:rcpt:" + (to_address or "").strip().lower()
+    return ADDRESS_PREFIX + (to_address or "").strip().lower()
+
+
+def recipient_update(added: dict = None, removed: list = None) -> str:
+    return json.dumps({"add": added or {}, "remove": removed or []})
+
+
+def dnsbl_key(target: str, dnsbl: str) -> str:
+    return f"mailtester:dnsbl:{target.lower()}:{dnsbl}"
+
+
+def dnsbl_health_key(dnsbl: str) -> str:
+    return f"mailtester:dnsbl_health:{dnsbl}"
+
+
+def dnsbl_breaker_key(dnsbl: str) -> str:
+    return f"mailtester:dnsbl_breaker:{dnsbl}"
+
+
+def dnsbl_tripped_key(dnsbl: str) -> str:
+    return f"mailtester:dnsbl_tripped:{dnsbl}"
+
+
+def dnsbl_probe_key(dnsbl: str) -> str:
+    return f"mailtester:dnsbl_probe:{dnsbl}"
+
+
+def spf_tree_key(domain: str) -> str:
+    return f"mailtester:spf_tree:{domain.strip('.').lower()}"
+
+
+def spf_result_key(digest: str) -> str:
+    return f"mailtester:spf_result:{digest}"
+
+
+def quota_key(scope: str, holder: str, day: str) -> str:
+    return f"mailtester:quota:{day}:{scope}:{holder}"
+
+
+def delivery_key(digest: str) -> str:
+    return f"mailtester:delivery:{digest}"
+
+
+def delivery_lock_key(digest: str) -> str:
+    return f"mailtester:delivery_lock:{digest}"
+
+
+def events_channel(to_address: str) -> str:
+    return EVENTS_PREFIX + (to_address or "").strip().lower()
+
+
+def status_key(to_address: str) -> str:
+    return "mailtester:status:" + (to_address or "").strip().lower()
+
+
+STATUS_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'order')
+if ARGV[1] ~= '' then
+    if current and current > ARGV[1] then
+        return 0
+    end
+    if current ~= ARGV[1] then
+        redis.call('DEL', KEYS[1])
+    end
+    redis.call('HSET', KEYS[1], 'order', ARGV[1])
+end
+if #ARGV > 3 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', KEYS[2], ARGV[3])
+end
+return 1
+"""
+
+
+def status_order(event_id: str, received_at) -> str:
+    if received_at is None:
+        return str(event_id or "")
+    if received_at.tzinfo is None:
+        received_at = received_at.replace(tzinfo=timezone.utc)
+    return f"{int(received_at.timestamp() * 1000):015d}:{event_id or ''}"
+
+
+def status_call(to_address: str, fields: dict, publish: bool, order: str) -> dict:
+    values = {k: str(v) for k, v in fields.items() if v is not None}
+    args = [order or "", TEST_ADDRESS_TTL_MINUTES * 60, json.dumps(fields, default=str) if publish else ""]
+    for item in values.items():
+        args.extend(item)
+    return {"keys": [status_key(to_address), events_channel(to_address)], "args": args}
+
+
+def save_status(to_address: str, fields: dict, publish: bool = True, order: str = None):
+    try:
+        client.register_script(STATUS_SCRIPT)(**status_call(to_address, fields, publish, order))
+    except Exception as e:
+        print("durum yazilamadi:", to_address, fields.get("status"), repr(e), flush=True)
+
+
+async def save_status_async(to_address: str, fields: dict, publish: bool = True, order: str = None):
+    try:
+        await async_client.register_script(STATUS_SCRIPT)(**status_call(to_address, fields, publish, order))
+    except Exception as e:
+        print("durum yazilamadi:", to_address, fields.get("status"), repr(e), flush=True)
+
+
+def publish_status(to_address: str, status: str, event: dict = None, **fields):
+    if event is None:
+        save_status(to_address, dict(fields, status=status))
+        return
+
+    fields = dict(fields, status=status, event_id=str(event["_id"]), received_at=event.get("received_at"))
+    save_status(to_address, fields, order=status_order(fields["event_id"], event.get("received_at")))
+
+
+def read_status(to_address: str) -> dict:
+    try:
+        return client.hgetall(status_key(to_address)) or {}
+    except Exception as e:
+        print("durum okunamadi:", to_address, repr(e), flush=True)
+        return {}
+
+
+async def read_status_async(to_address: str) -> dict:
+    try:
+        return await async_client.hgetall(status_key(to_address)) or {}
+    except Exception as e:
+        print("durum okunamadi:", to_address, repr(e), flush=True)
+        return {}
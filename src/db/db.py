@@ -1,7 +1,14 @@
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
 
 from src.config import MONGODB_URI, MONGO_DB_NAME
 
 client = MongoClient(MONGODB_URI, connect=False)
+async_client = AsyncMongoClient(MONGODB_URI, connect=False)
+
+
 def get_db():
     return client[MONGO_DB_NAME]
+
+
+def get_async_db():
+    return async_client[MONGO_DB_NAME]
@@ -0,0 +1,77 @@
+import json
+import zlib
+from datetime import datetime
+
+from bson import ObjectId
+
+from src.config import TEST_ADDRESS_TTL_MINUTES
+from src.db.cache import get_async_raw_cache, get_raw_cache
+
+
+def report_key(analysis_id: str) -> str:
+    return f"mailtester:report:{analysis_id}"
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dump_json(document) -> bytes:
+    return json.dumps(document, default=json_default, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def report_pipeline(pipe, document: dict):
+    analysis_id = str(document["_id"])
+    owner = ((document.get("owner") or {}).get("user_id") or "")
+
+    pipe.hset(report_key(analysis_id), mapping={"owner": owner, "body": zlib.compress(dump_json(document))})
+    pipe.expire(report_key(analysis_id), TEST_ADDRESS_TTL_MINUTES * 60)
+    return pipe
+
+
+def store_report(document: dict):
+    try:
+        report_pipeline(get_raw_cache().pipeline(transaction=False), document).execute()
+    except Exception as e:
+        print("rapor onbellege yazilamadi:", document.get("_id"), repr(e), flush=True)
+
+
+async def store_report_async(document: dict):
+    try:
+        await report_pipeline(get_async_raw_cache().pipeline(transaction=False), document).execute()
+    except Exception as e:
+        print("rapor onbellege yazilamadi:", document.get("_id"), repr(e), flush=True)
+
+
+def unpack_report(owner, body):
+    if body is None:
+        return None
+    return (owner or b"").decode(), zlib.decompress(body)
+
+
+def load_report(analysis_id: str):
+    try:
+        return unpack_report(*get_raw_cache().hmget(report_key(analysis_id), ["owner", "body"]))
+    except Exception as e:
+        print("rapor onbellekten okunamadi:", analysis_id, repr(e), flush=True)
+        return None
+
+
+async def load_report_async(analysis_id: str):
+    try:
+        return unpack_report(*await get_async_raw_cache().hmget(report_key(analysis_id), ["owner", "body"]))
+    except Exception as e:
+        print("rapor onbellekten okunamadi:", analysis_id, repr(e), flush=True)
+        return None
+
+
+def analyzed_body(result: bytes, event_id: str = None) -> bytes:
+    head = b'{"status":"analyzed",'
+    if event_id:
+        head += b'"event_id":' + dump_json(event_id) + b","
+    return head + b'"result":' + result + b"}"
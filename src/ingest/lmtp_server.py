@@ -1,74 +1,97 @@
 import asyncio
-import email
 from datetime import datetime, timezone
 
 import gridfs
+from bson import ObjectId
+from pymongo import UpdateOne
 
-from src.config import MAIL_DOMAIN, MESSAGE_SIZE_LIMIT
+from src.config import MAIL_DOMAIN
+from src.db.cache import publish_status
 from src.db.db import get_db
 from src.ingest.connection import get_connection_info
+from src.ingest.outbox import outbox
+from src.ingest.spool import bounded, spool
 
 
-def store_message(to_address: str, mail_from: str, raw: bytes) -> str:
+def store_message(recipients: list, mail_from: str, stored: dict) -> list:
     db = get_db()
-    fs = gridfs.GridFS(db, collection="raw_mails")
 
-    test_email = db.test_emails.find_one(
-        {"to_address": to_address},
-        {"created_ip": 1, "owner_user_id": 1, "api_key_id": 1}
-    ) or {}
-
-    msg = email.message_from_bytes(raw)
-    connection = get_connection_info(msg)
-    now = datetime.now(timezone.utc)
-
-    raw_id = fs.put(raw, filename=to_address, upload_date=now)
-
-    event = {
-        "to_address": to_address,
-        "mail_from": mail_from,
-        "raw_id": str(raw_id),
-        "size": len(raw),
-        "received_at": now,
-        "connection": connection,
-        "subject": msg.get("Subject"),
-        "message_id": msg.get("Message-ID"),
-        "created_ip": test_email.get("created_ip"),
-        "owner_user_id": test_email.get("owner_user_id"),
-        "api_key_id": test_email.get("api_key_id"),
-        "analysis_started_at": None,
-        "analysis_id": None,
-        "analyzed_at": None,
-        "last_error": None,
+    owners = {
+        doc["to_address"]: doc
+        for doc in db.test_emails.find(
+            {"to_address": {"$in": recipients}},
+            {"to_address": 1, "created_ip": 1, "owner_user_id": 1, "api_key_id": 1}
+        )
     }
 
-    inserted = db.mail_events.insert_one(event)
-
-    db.test_emails.update_one(
-        {"to_address": to_address},
-        {
-            "$set": {
-                "status": "received",
-                "receiver_at": now,
-                "last_mail_event_id": str(inserted.inserted_id),
-                "last_error": None,
-            },
-            "$inc": {"mail_count": 1},
-        }
-    )
-
-    return str(inserted.inserted_id)
+    msg = stored["headers"]
+    connection = get_connection_info(msg)
+    now = stored.get("received_at") or datetime.now(timezone.utc)
+
+    events = []
+    for to_address in recipients:
+        test_email = owners.get(to_address) or {}
+        events.append({
+            "to_address": to_address,
+            "mail_from": mail_from,
+            "raw_id": stored["raw_id"],
+            "size": stored["size"],
+            "sha256": stored["sha256"],
+            "content_sha256": stored.get("content_sha256"),
+            "received_at": now,
+            "connection": connection,
+            "subject": msg.get("Subject"),
+            "message_id": msg.get("Message-ID"),
+            "created_ip": test_email.get("created_ip"),
+            "owner_user_id": test_email.get("owner_user_id"),
+            "api_key_id": test_email.get("api_key_id"),
+            "analysis_started_at": None,
+            "analysis_id": None,
+            "analyzed_at": None,
+            "last_error": None,
+            "outbox": True,
+            "enqueued_at": None,
+        })
+
+    event_ids = [str(event_id) for event_id in db.mail_events.insert_many(events).inserted_ids]
+
+    db.test_emails.bulk_write([
+        UpdateOne(
+            {"to_address": to_address},
+            {
+                "$set": {
+                    "status": "received",
+                    "receiver_at": now,
+                    "last_mail_event_id": event_id,
+                    "last_error": None,
+                },
+                "$inc": {"mail_count": 1},
+            }
+        )
+        for to_address, event_id in zip(recipients, event_ids)
+    ], ordered=False)
+
+    for to_address, event in zip(recipients, events):
+        publish_status(to_address, "received", event)
+
+    return event_ids
+
+
+def discard_raw(raw_id: str):
+    try:
+        db = get_db()
+        if db.mail_events.find_one({"raw_id": raw_id}, {"_id": 1}) is None:
+            gridfs.GridFS(db, collection="raw_mails").delete(ObjectId(raw_id))
+    except Exception as e:
+        print("ham mail silinemedi:", raw_id, repr(e), flush=True)
 
 
 class MailHandler:
 
     async def handle_DATA(self, server, session, envelope):
-        raw = envelope.content or b""
-
-        if len(raw) > MESSAGE_SIZE_LIMIT:
-            return "552 Message too large"
-
+        stored = envelope.stored
         mail_from = envelope.mail_from or ""
+        recipients = []
 
         for rcpt in envelope.rcpt_tos:
             to_address = (rcpt or "").strip().lower()
@@ -77,15 +100,36 @@ class MailHandler:
                 print("beklenmeyen domain, atlandı:", to_address, flush=True)
                 continue
 
-            try:
-                event_id = await asyncio.to_thread(store_message, to_address, mail_from, raw)
-            except Exception as e:
-                print("mail kaydedilemedi:", to_address, repr(e), flush=True)
-                return "451 Temporary failure, try again"
-
-            print("mail alındı:", to_address, event_id, flush=True)
+            if to_address not in recipients:
+                recipients.append(to_address)
 
-            from src.worker.tasks import analyze_received_mail
-            analyze_received_mail.delay(event_id)
+        if not recipients:
+            if not stored["spooled"]:
+                await asyncio.to_thread(discard_raw, stored["raw_id"])
+            return "250 Message accepted"
 
+        if not stored["spooled"]:
+            try:
+                event_ids = await asyncio.to_thread(bounded, store_message, recipients, mail_from, stored)
+            except Exception as e:
+                print("mail kaydedilemedi:", recipients, repr(e), flush=True)
+                spool.mark_down()
+            else:
+                for to_address, event_id in zip(recipients, event_ids):
+                    print("mail alındı:", to_address, event_id, flush=True)
+
+                outbox.push(event_ids)
+                return "250 Message accepted"
+
+        try:
+            if not spool.enabled:
+                raise RuntimeError("spool is disabled")
+            await asyncio.to_thread(spool.commit, recipients, mail_from, stored)
+        except Exception as e:
+            print("mail diske yazilamadi:", recipients, repr(e), flush=True)
+            if not stored["spooled"]:
+                await asyncio.to_thread(discard_raw, stored["raw_id"])
+            return "451 Temporary failure, try again"
+
+        print("mail diske alındı:", recipients, stored["raw_id"], flush=True)
         return "250 Message accepted"
@@ -1,10 +1,11 @@
 import asyncio
 
-from aiosmtpd.lmtp import LMTP
-
 from src.config import INGEST_LMTP_PORT, INGEST_MAP_PORT, MAIL_DOMAIN, MESSAGE_SIZE_LIMIT
 from src.ingest.lmtp_server import MailHandler
-from src.ingest.recipient_map import handle_client
+from src.ingest.outbox import outbox
+from src.ingest.recipient_map import handle_client, recipients
+from src.ingest.spool import spool
+from src.ingest.streaming import StreamingLMTP
 
 
 async def main():
@@ -13,9 +14,12 @@ async def main():
 
     loop = asyncio.get_running_loop()
     handler = MailHandler()
+    index = asyncio.create_task(recipients.run())
+    publisher = asyncio.create_task(outbox.run())
+    drainer = asyncio.create_task(spool.run())
 
     lmtp = await loop.create_server(
-        lambda: LMTP(handler, data_size_limit=MESSAGE_SIZE_LIMIT, enable_SMTPUTF8=True),
+        lambda: StreamingLMTP(handler, data_size_limit=MESSAGE_SIZE_LIMIT, enable_SMTPUTF8=True),
         host="0.0.0.0",
         port=INGEST_LMTP_PORT,
     )
@@ -29,7 +33,7 @@ async def main():
     print(f"ingest çalışıyor: lmtp={INGEST_LMTP_PORT} recipient_map={INGEST_MAP_PORT} domain={MAIL_DOMAIN}", flush=True)
 
     async with lmtp, recipient_map:
-        await asyncio.gather(lmtp.serve_forever(), recipient_map.serve_forever())
+        await asyncio.gather(lmtp.serve_forever(), recipient_map.serve_forever(), index, publisher, drainer)
 
 
 if __name__ == "__main__":
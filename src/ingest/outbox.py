@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from src.config import OUTBOX_BATCH_SIZE, OUTBOX_QUEUE_SIZE, OUTBOX_SWEEP_AGE, OUTBOX_SWEEP_INTERVAL
+from src.db.db import get_db
+
+
+def acknowledge(event_ids: list):
+    get_db().mail_events.update_many(
+        {"_id": {"$in": [ObjectId(event_id) for event_id in event_ids]}},
+        {"$set": {"outbox": False, "enqueued_at": datetime.now(timezone.utc)}}
+    )
+
+
+def publish(event_ids: list):
+    from src.worker.celery_app import celery_app
+    from src.worker.tasks import analyze_received_mail
+
+    sent = []
+    try:
+        with celery_app.producer_or_acquire() as producer:
+            for event_id in event_ids:
+                analyze_received_mail.apply_async((event_id,), producer=producer)
+                sent.append(event_id)
+    finally:
+        if sent:
+            acknowledge(sent)
+
+
+def ensure_index():
+    get_db().mail_events.create_index(
+        [("received_at", 1)], name="outbox_received_at", partialFilterExpression={"outbox": True}
+    )
+
+
+def stale_events(limit: int) -> list:
+    before = datetime.now(timezone.utc) - timedelta(seconds=OUTBOX_SWEEP_AGE)
+    cursor = get_db().mail_events.find(
+        {"outbox": True, "received_at": {"$lt": before}},
+        {"_id": 1}
+    ).sort("received_at", 1).limit(limit)
+    return [str(doc["_id"]) for doc in cursor]
+
+
+class Outbox:
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=max(1, OUTBOX_QUEUE_SIZE))
+        self.pending = set()
+
+    def push(self, event_ids: list):
+        for event_id in event_ids:
+            if event_id in self.pending:
+                continue
+            try:
+                self.queue.put_nowait(event_id)
+            except asyncio.QueueFull:
+                print("gorev kuyrugu dolu, tarayici gonderecek:", event_id, flush=True)
+                return
+            self.pending.add(event_id)
+
+    async def publisher(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < OUTBOX_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                await asyncio.to_thread(publish, batch)
+            except Exception as e:
+                print("gorevler kuyruga yazilamadi:", len(batch), repr(e), flush=True)
+                await asyncio.sleep(1)
+            finally:
+                self.pending.difference_update(batch)
+
+    async def sweeper(self):
+        while True:
+            try:
+                self.push(await asyncio.to_thread(stale_events, OUTBOX_BATCH_SIZE * 10))
+            except Exception as e:
+                print("bekleyen gorevler okunamadi:", repr(e), flush=True)
+
+            await asyncio.sleep(OUTBOX_SWEEP_INTERVAL)
+
+    async def run(self):
+        try:
+            await asyncio.to_thread(ensure_index)
+        except Exception as e:
+            print("outbox indeksi olusturulamadi:", repr(e), flush=True)
+
+        await asyncio.gather(self.publisher(), self.sweeper())
+
+
+outbox = Outbox()
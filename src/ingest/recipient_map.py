@@ -1,41 +1,187 @@
 import asyncio
+import json
+import time
+from collections import OrderedDict
 from urllib.parse import quote, unquote
 
-from src.db.cache import address_key, get_cache
+from src.config import RCPT_NEGATIVE_SIZE, RCPT_NEGATIVE_TTL
+from src.db.cache import ADDRESS_PREFIX, RECIPIENTS_CHANNEL, REVOKED_ADDRESSES_KEY, address_key, get_async_cache
+from src.processor.generator import signed_expiry
 
 
 REJECT_MESSAGE = "REJECT test address is unknown or expired"
+SCAN_BATCH = 1000
+PRUNE_EVERY = 1024
+MAX_LINE = 4096
 
 
-def lookup(to_address: str) -> str:
-    cache = get_cache()
-    if cache.exists(address_key(to_address)):
-        return "OK"
-    return REJECT_MESSAGE
+def normalize(to_address: str) -> str:
+    return (to_address or "").strip().lower()
+
+
+class RecipientIndex:
+
+    def __init__(self):
+        self.live = {}
+        self.revoked = {}
+        self.negative = OrderedDict()
+        self.synced = False
+        self.additions = 0
+
+    def prune(self, now: float):
+        for table in (self.live, self.revoked):
+            for address in [a for a, expires_at in table.items() if expires_at <= now]:
+                del table[address]
+
+    def apply(self, update: dict):
+        for address, expires_at in (update.get("add") or {}).items():
+            address = normalize(address)
+            self.live[address] = float(expires_at)
+            self.negative.pop(address, None)
+            self.additions += 1
+            if self.additions % PRUNE_EVERY == 0:
+                self.prune(time.time())
+
+        for address in update.get("remove") or []:
+            address = normalize(address)
+            self.live.pop(address, None)
+            expires = signed_expiry(address)
+            if expires:
+                self.revoked[address] = float(expires)
+
+    async def snapshot(self, cache) -> dict:
+        live = {}
+        cursor = 0
+
+        while True:
+            cursor, keys = await cache.scan(cursor, match=ADDRESS_PREFIX + "*", count=SCAN_BATCH)
+
+            if keys:
+                pipe = cache.pipeline(transaction=False)
+                for key in keys:
+                    pipe.pttl(key)
+                now = time.time()
+
+                for key, ttl in zip(keys, await pipe.execute()):
+                    if ttl > 0:
+                        live[key[len(ADDRESS_PREFIX):]] = now + ttl / 1000.0
+                    elif ttl == -1:
+                        live[key[len(ADDRESS_PREFIX):]] = float("inf")
+
+            if not cursor:
+                return live
+
+    async def revocations(self, cache) -> dict:
+        revoked = await cache.zrangebyscore(REVOKED_ADDRESSES_KEY, time.time(), "+inf", withscores=True)
+        return {normalize(address): float(expires_at) for address, expires_at in revoked}
+
+    async def run(self):
+        while True:
+            cache = get_async_cache()
+            pubsub = cache.pubsub()
+            try:
+                await pubsub.subscribe(RECIPIENTS_CHANNEL)
+                self.live = await self.snapshot(cache)
+                self.revoked = await self.revocations(cache)
+                self.negative.clear()
+                self.synced = True
+                print("alici indeksi hazir:", len(self.live), flush=True)
+
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.apply(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("alici indeksi koptu:", repr(e), flush=True)
+            finally:
+                self.synced = False
+                await pubsub.aclose()
+
+            await asyncio.sleep(1)
+
+    def remember_unknown(self, address: str, now: float):
+        self.negative[address] = now + RCPT_NEGATIVE_TTL
+        self.negative.move_to_end(address)
+        while len(self.negative) > RCPT_NEGATIVE_SIZE:
+            self.negative.popitem(last=False)
+
+    async def lookup(self, to_address: str) -> str:
+        address = normalize(to_address)
+        now = time.time()
+
+        expires = signed_expiry(address)
+        if expires is not None:
+            if expires > now and address not in self.revoked:
+                return "OK"
+            return REJECT_MESSAGE
+
+        if self.synced:
+            expires_at = self.live.get(address)
+            if expires_at is not None and expires_at > now:
+                return "OK"
+
+            until = self.negative.get(address)
+            if until is not None and until > now:
+                return REJECT_MESSAGE
+
+        additions = self.additions
+        synced = self.synced
+
+        if await get_async_cache().exists(address_key(address)):
+            return "OK"
+
+        if synced and self.synced and self.additions == additions:
+            self.remember_unknown(address, now)
+
+        return REJECT_MESSAGE
+
+
+recipients = RecipientIndex()
+
+
+async def answer(line: bytes) -> bytes:
+    parts = line.decode(errors="ignore").strip().split(" ", 1)
+    if len(parts) != 2 or parts[0].lower() != "get":
+        return b"400 only get is supported\n"
+
+    try:
+        action = await recipients.lookup(unquote(parts[1]))
+    except Exception as e:
+        print("recipient lookup hatası:", repr(e), flush=True)
+        return b"400 lookup failed\n"
+
+    return ("200 " + quote(action) + "\n").encode()
 
 
 async def handle_client(reader, writer):
+    pending = b""
+    oversized = False
+
     try:
         while True:
-            line = await reader.readline()
-            if not line:
+            chunk = await reader.read(65536)
+            if not chunk:
                 break
 
-            parts = line.decode(errors="ignore").strip().split(" ", 1)
-            if len(parts) != 2 or parts[0].lower() != "get":
-                writer.write(b"400 only get is supported\n")
-                await writer.drain()
-                continue
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
 
-            try:
-                action = await asyncio.to_thread(lookup, unquote(parts[1]))
-            except Exception as e:
-                print("recipient lookup hatası:", repr(e), flush=True)
-                writer.write(b"400 lookup failed\n")
-                await writer.drain()
-                continue
+            if oversized and lines:
+                lines.pop(0)
+                oversized = False
+
+            replies = list(await asyncio.gather(*[answer(line) for line in lines]))
 
-            writer.write(("200 " + quote(action) + "\n").encode())
-            await writer.drain()
+            if oversized:
+                pending = b""
+            elif len(pending) > MAX_LINE:
+                replies.append(b"400 request too long\n")
+                pending = b""
+                oversized = True
+
+            if replies:
+                writer.write(b"".join(replies))
+                await writer.drain()
     finally:
         writer.close()
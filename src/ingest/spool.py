@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from email.parser import BytesHeaderParser
+
+import gridfs
+import pymongo
+from bson import ObjectId
+
+from src.config import INGEST_MONGO_TIMEOUT, INGEST_SPOOL_PATH, SPOOL_DRAIN_INTERVAL, SPOOL_RETRY
+from src.db.db import get_db
+from src.ingest.outbox import outbox
+
+RECORD = struct.Struct(">IB12s")
+CHUNK = 0x43
+ENVELOPE = 0x45
+
+
+def bounded(call, *args):
+    with pymongo.timeout(INGEST_MONGO_TIMEOUT):
+        return call(*args)
+
+
+def scan(f) -> tuple:
+    size = os.fstat(f.fileno()).st_size
+    chunks = {}
+    envelopes = []
+
+    while True:
+        head = f.read(RECORD.size)
+        if len(head) < RECORD.size:
+            break
+
+        length, kind, spool_id = RECORD.unpack(head)
+        offset = f.tell()
+        if offset + length > size:
+            break
+
+        if kind == ENVELOPE:
+            envelopes.append((ObjectId(spool_id), json.loads(f.read(length))))
+        else:
+            chunks.setdefault(ObjectId(spool_id), []).append((offset, length))
+            f.seek(offset + length)
+
+    return chunks, envelopes
+
+
+def replay(db, f, raw_id: ObjectId, envelope: dict, chunks: list) -> list:
+    from src.ingest.lmtp_server import store_message
+
+    received_at = datetime.fromisoformat(envelope["received_at"])
+
+    if db.raw_mails.files.find_one({"_id": raw_id}, {"_id": 1}) is None:
+        if not chunks:
+            print("diskteki mailin govdesi yok:", raw_id, flush=True)
+            return []
+
+        db.raw_mails.chunks.delete_many({"files_id": raw_id})
+        upload = gridfs.GridFS(db, collection="raw_mails").new_file(
+            _id=raw_id, filename=envelope["recipients"][0], upload_date=received_at, sha256=envelope["sha256"]
+        )
+        for offset, length in chunks:
+            f.seek(offset)
+            upload.write(f.read(length))
+        upload.close()
+
+    done = {doc["to_address"] for doc in db.mail_events.find({"raw_id": str(raw_id)}, {"to_address": 1})}
+    recipients = [to_address for to_address in envelope["recipients"] if to_address not in done]
+    if not recipients:
+        return []
+
+    return store_message(recipients, envelope["mail_from"], {
+        "raw_id": str(raw_id),
+        "size": envelope["size"],
+        "sha256": envelope["sha256"],
+        "content_sha256": envelope.get("content_sha256"),
+        "headers": BytesHeaderParser().parsebytes(envelope["header"].encode("latin-1")),
+        "received_at": received_at,
+    })
+
+
+class SpoolUpload:
+
+    def __init__(self, spool, filename: str):
+        self.spool = spool
+        self.filename = filename
+        self._id = ObjectId()
+        self.sha256 = None
+        spool.hold(self._id)
+
+    def write(self, chunk: bytes):
+        self.spool.append(CHUNK, self._id, chunk)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        self.spool.release(self._id)
+
+
+class Spool:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.draining = path + ".draining"
+        self.lock = threading.Lock()
+        self.file = None
+        self.held = set()
+        self.down_until = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def active(self) -> bool:
+        return self.enabled and self.down_until > time.monotonic()
+
+    def mark_down(self):
+        if self.enabled:
+            self.down_until = time.monotonic() + SPOOL_RETRY
+
+    def hold(self, spool_id: ObjectId):
+        with self.lock:
+            self.held.add(spool_id)
+
+    def release(self, spool_id):
+        with self.lock:
+            self.held.discard(ObjectId(spool_id))
+
+    def upload(self, filename: str) -> SpoolUpload:
+        return SpoolUpload(self, filename)
+
+    def append(self, kind: int, spool_id: ObjectId, payload: bytes, sync: bool = False):
+        record = RECORD.pack(len(payload), kind, spool_id.binary) + payload
+
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "ab")
+            self.file.write(record)
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def commit(self, recipients: list, mail_from: str, stored: dict):
+        envelope = {
+            "recipients": recipients,
+            "mail_from": mail_from,
+            "size": stored["size"],
+            "sha256": stored["sha256"],
+            "content_sha256": stored.get("content_sha256"),
+            "header": stored["header"].decode("latin-1"),
+            "received_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.append(ENVELOPE, ObjectId(stored["raw_id"]), json.dumps(envelope).encode("utf-8"), sync=True)
+
+    def rotate(self) -> bool:
+        with self.lock:
+            if os.path.exists(self.draining):
+                return True
+            if self.held or not os.path.isfile(self.path) or not os.path.getsize(self.path):
+                return False
+
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            os.rename(self.path, self.draining)
+            return True
+
+    def drain(self) -> list:
+        db = get_db()
+        bounded(db.command, "ping")
+
+        if not self.rotate():
+            self.down_until = 0.0
+            return []
+
+        event_ids = []
+        with open(self.draining, "rb") as f:
+            chunks, envelopes = scan(f)
+            for raw_id, envelope in envelopes:
+                event_ids += replay(db, f, raw_id, envelope, chunks.get(raw_id, []))
+
+        os.remove(self.draining)
+        self.down_until = 0.0
+        print("diskteki mailler aktarildi:", len(envelopes), flush=True)
+        return event_ids
+
+    async def run(self):
+        while self.enabled:
+            await asyncio.sleep(SPOOL_DRAIN_INTERVAL)
+            try:
+                outbox.push(await asyncio.to_thread(self.drain))
+            except Exception as e:
+                print("diskteki mailler aktarilamadi:", repr(e), flush=True)
+                self.mark_down()
+
+
+spool = Spool(INGEST_SPOOL_PATH)
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from email.parser import BytesHeaderParser
+
+import gridfs
+from aiosmtpd.lmtp import LMTP
+from aiosmtpd.smtp import MISSING, syntax
+
+from src.config import INGEST_CHUNK_SIZE, INGEST_HEADER_LIMIT
+from src.db.db import get_db
+from src.ingest.spool import bounded, spool
+
+TEMPORARY_FAILURE = "451 Temporary failure, try again"
+
+class RawSink:
+
+    def __init__(self, upload, spooled: bool = False):
+        self.upload = upload
+        self.spooled = spooled
+        self.sha256 = hashlib.sha256()
+        self.content_sha256 = hashlib.sha256()
+        self.local_received = None
+        self.size = 0
+        self.header = bytearray()
+        self.in_header = True
+        self.buffer = bytearray()
+
+    @classmethod
+    def open(cls, filename: str) -> "RawSink":
+        db = get_db()
+        db.command("ping")
+        fs = gridfs.GridFS(db, collection="raw_mails")
+        return cls(fs.new_file(filename=filename, upload_date=datetime.now(timezone.utc)))
+
+    @classmethod
+    def to_spool(cls, filename: str) -> "RawSink":
+        return cls(spool.upload(filename), spooled=True)
+
+    async def write(self, line: bytes):
+        if line.startswith(b"."):
+            line = line[1:]
+
+        self.sha256.update(line)
+        self.hash_content(line)
+        self.size += len(line)
+
+        if self.in_header:
+            if line in (b"\r\n", b"\n") or len(self.header) + len(line) > INGEST_HEADER_LIMIT:
+                self.in_header = False
+            else:
+                self.header += line
+
+        self.buffer += line
+        if len(self.buffer) >= INGEST_CHUNK_SIZE:
+            await self.flush()
+
+    def hash_content(self, line: bytes):
+        if self.local_received is None:
+            self.local_received = line[:9].lower() == b"received:"
+        elif self.local_received and line[:1] not in (b" ", b"\t"):
+            self.local_received = False
+
+        if not self.local_received:
+            self.content_sha256.update(line)
+
+    async def flush(self):
+        if self.buffer:
+            chunk = bytes(self.buffer)
+            self.buffer.clear()
+            await asyncio.to_thread(bounded, self.upload.write, chunk)
+
+    async def close(self) -> dict:
+        await self.flush()
+
+        digest = self.sha256.hexdigest()
+        self.upload.sha256 = digest
+        await asyncio.to_thread(bounded, self.upload.close)
+
+        return {
+            "raw_id": str(self.upload._id),
+            "size": self.size,
+            "sha256": digest,
+            "content_sha256": self.content_sha256.hexdigest(),
+            "header": bytes(self.header),
+            "headers": BytesHeaderParser().parsebytes(bytes(self.header)),
+            "spooled": self.spooled,
+        }
+
+    async def abort(self):
+        self.buffer.clear()
+        try:
+            await asyncio.to_thread(bounded, self.upload.abort)
+        except Exception as e:
+            print("yarim mail silinemedi:", self.upload._id, repr(e), flush=True)
+
+
+class StreamingLMTP(LMTP):
+
+    @syntax("DATA")
+    async def smtp_DATA(self, arg: str) -> None:
+        if await self.check_helo_needed():
+            return
+        if await self.check_auth_needed("DATA"):
+            return
+        if not self.envelope.rcpt_tos:
+            await self.push("503 Error: need RCPT command")
+            return
+        if arg:
+            await self.push("501 Syntax: DATA")
+            return
+
+        sink = None
+        if not spool.active():
+            try:
+                sink = await asyncio.to_thread(bounded, RawSink.open, self.envelope.rcpt_tos[0])
+            except Exception as e:
+                print("gridfs akisi acilamadi:", repr(e), flush=True)
+                spool.mark_down()
+
+        if sink is None:
+            if not spool.enabled:
+                await self.push(TEMPORARY_FAILURE)
+                return
+            sink = RawSink.to_spool(self.envelope.rcpt_tos[0])
+
+        await self.push("354 End data with <CR><LF>.<CR><LF>")
+        limit = self.data_size_limit
+        received = 0
+        fragments = []
+        error = None
+
+        try:
+            while self.transport is not None:
+                try:
+                    line = await self._reader.readuntil(b"\r\n")
+                except asyncio.LimitOverrunError as e:
+                    error = error or "500 Line too long (see RFC5321 4.5.3.1.6)"
+                    line = await self._reader.read(e.consumed)
+
+                if not fragments and line == b".\r\n":
+                    break
+
+                received += len(line)
+                if error is None and limit and received > limit:
+                    error = "552 Error: Too much mail data"
+
+                fragments.append(line)
+                if not line.endswith(b"\r\n"):
+                    continue
+
+                line = b"".join(fragments)
+                fragments.clear()
+
+                if error is None and len(line) > self.line_length_limit:
+                    error = "500 Line too long (see RFC5321 4.5.3.1.6)"
+                if error is None:
+                    try:
+                        await sink.write(line)
+                    except Exception as e:
+                        print("ham mail yazilamadi:", repr(e), flush=True)
+                        spool.mark_down()
+                        error = TEMPORARY_FAILURE
+        except asyncio.CancelledError:
+            self._writer.close()
+            await asyncio.shield(sink.abort())
+            raise
+        except Exception:
+            await sink.abort()
+            raise
+
+        if error is not None:
+            await sink.abort()
+            await self.push(error)
+            self._set_post_data_state()
+            return
+
+        try:
+            self.envelope.stored = await sink.close()
+        except Exception as e:
+            print("ham mail kaydedilemedi:", repr(e), flush=True)
+            spool.mark_down()
+            await sink.abort()
+            self._set_post_data_state()
+            await self.push(TEMPORARY_FAILURE)
+            return
+
+        self.envelope.content = b""
+        self.envelope.original_content = b""
+
+        try:
+            status = await self._call_handler_hook("DATA")
+        finally:
+            if sink.spooled:
+                spool.release(sink.upload._id)
+        self._set_post_data_state()
+        await self.push("250 OK" if status is MISSING else status)
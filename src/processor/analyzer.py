@@ -1,11 +1,11 @@
-from email.header import decode_header, make_header
-
 from src.config import SPAM_PENALTY_CAP
 from src.processor.content import inspect_content
+from src.processor.dkim_check import check_dkim
+from src.processor.message import ParsedMessage
+from src.processor.pipeline import run_steps
 from src.processor.score import Score
 from src.processor.service import (
     check_spf,
-    check_dkim,
     check_dmarc,
     check_rdns,
     check_blacklists,
@@ -25,38 +25,40 @@ SPAM_RULE_SKIP = (
 
 SPF_PENALTY = {"fail": 2.0, "softfail": 1.0, "neutral": 0.5, "none": 0.5, "permerror": 1.0, "temperror": 0.3}
 
-
-def decode_header_value(value):
-    if not value:
-        return value
-    try:
-        return str(make_header(decode_header(value)))
-    except Exception:
-        return value
+HEADER_FIELDS = ("From", "To", "Subject", "Date", "Message-ID", "Reply-To", "Return-Path", "List-Unsubscribe")
 
 
 class Analyzer:
-    def __init__(self, email_message, domain, sender_ip=None, raw_email=None, connection=None, envelope_from=None):
-        self.msg = email_message
+    def __init__(self, message: ParsedMessage, domain, sender_ip=None, connection=None, envelope_from=None):
+        self.message = message
         self.domain = domain
         self.sender_ip = sender_ip
         self.connection = connection or {}
         self.envelope_from = envelope_from
-        self.raw_email = raw_email if isinstance(raw_email, bytes) else self._fallback_raw()
         self.public_ip = sender_ip if sender_ip and is_public_ip(sender_ip) else None
         self.score = Score()
 
-    def _fallback_raw(self):
-        try:
-            return self.msg.as_bytes()
-        except Exception:
-            return b""
+    def steps(self, helo, subject):
+        return {
+            "spf": ((), lambda: check_spf(self.domain, self.public_ip, self.envelope_from, helo)),
+            "dkim": ((), lambda: check_dkim(self.domain, self.message)),
+            "dmarc": (("spf", "dkim"), lambda spf, dkim: check_dmarc(self.domain, spf, dkim)),
+            "rdns": ((), lambda: check_rdns(self.public_ip) if self.public_ip else None),
+            "blacklists": ((), lambda: check_blacklists(self.public_ip) if self.public_ip else None),
+            "content": ((), lambda: inspect_content(self.message, subject)),
+            "domain_blacklists": (("content",), lambda content: check_domain_blacklists(
+                [self.domain] + [h for h in content["link_hosts"]])),
+            "spamassassin": ((), lambda: spamd_check(self.message.view)),
+        }
 
     def analyze(self):
         checks = {}
         helo = self.connection.get("helo")
+        headers = {name: self.message.decoded(name) for name in HEADER_FIELDS if name in self.message}
+
+        results = run_steps(self.steps(helo, headers.get("Subject")))
 
-        spf = check_spf(self.domain, self.public_ip, self.envelope_from, helo)
+        spf = results["spf"]
         checks["spf"] = spf
 
         if spf["status"] == "unknown":
@@ -70,7 +72,7 @@ class Analyzer:
                              details=spf.get("explanation") or "",
                              how_to_fix=f"Add {self.public_ip} to the SPF record of {self.domain}.")
 
-        dkim = check_dkim(self.domain, self.raw_email)
+        dkim = results["dkim"]
         checks["dkim"] = dkim
 
         if dkim["status"] == "unknown":
@@ -92,7 +94,7 @@ class Analyzer:
                              how_to_fix="The signature does not match the message. Check whether a relay rewrites "
                                         "the body or headers after signing.")
 
-        dmarc = check_dmarc(self.domain, spf, dkim)
+        dmarc = results["dmarc"]
         checks["dmarc"] = dmarc
 
         if dmarc["status"] == "unknown" or dmarc["result"] == "unknown":
@@ -109,7 +111,6 @@ class Analyzer:
             self.score.minus(0.3, "DMARC policy is set to none", code="DMARC_POLICY_NONE", severity="low",
                              how_to_fix="Move to p=quarantine and then p=reject once your reports look clean.")
 
-        headers = {name: decode_header_value(value) for name, value in self.msg.items()}
         header_check = {"status": "ok", "missing_required": [], "missing_recommended": [],
                         "raw": {
                             "from": headers.get("From"),
@@ -168,7 +169,7 @@ class Analyzer:
                                  how_to_fix="Set the sending server to greet with its own public hostname.")
 
         if self.public_ip:
-            rdns = check_rdns(self.public_ip)
+            rdns = results["rdns"]
             rdns["skipped"] = False
             rdns["status"] = ("unknown" if rdns.get("success") is None
                               else "ok" if rdns.get("matches")
@@ -192,7 +193,7 @@ class Analyzer:
                                      severity="low", details=f"helo={helo} rdns={rdns['hostname']}",
                                      how_to_fix="Use the same hostname for HELO and the PTR record.")
 
-            bl = check_blacklists(self.public_ip)
+            bl = results["blacklists"]
             checks["blacklists"] = bl
 
             listed_on = [k for k, v in bl.get("results", {}).items() if v == "listed"]
@@ -207,7 +208,7 @@ class Analyzer:
 
         checks["helo"] = helo_check
 
-        content = inspect_content(self.msg, headers.get("Subject"))
+        content = results["content"]
         checks["content"] = content
 
         if content["has_html"] and not content["has_plain"]:
@@ -248,8 +249,7 @@ class Analyzer:
             self.score.minus(0.2, "Subject has too many exclamation marks", code="SUBJ_EXCLAIM", severity="low",
                              how_to_fix="Keep punctuation in the subject to a minimum.")
 
-        domain_targets = [self.domain] + [h for h in content["link_hosts"]]
-        domain_bl = check_domain_blacklists(domain_targets)
+        domain_bl = results["domain_blacklists"]
         checks["domain_blacklists"] = domain_bl
 
         if domain_bl["listed"]:
@@ -259,7 +259,7 @@ class Analyzer:
                              details="; ".join(f"{i['domain']} on {i['list']}" for i in domain_bl["listed"]),
                              how_to_fix="Request delisting for the listed domain, or remove the link from the mail.")
 
-        sa = spamd_check(self.raw_email)
+        sa = results["spamassassin"]
         checks["spamassassin"] = sa
 
         penalty, counted = self.spam_penalty(sa)
@@ -294,7 +294,7 @@ class Analyzer:
 
         base["meta"] = meta
         base["checks"] = checks
-        base["raw_email"] = self.raw_email.decode("utf-8", errors="replace")
+        base["raw_email"] = self.message.text
         base["summary"] = {"score": base["score"], "grade": base["title"], "headline": base["description"],
                            "top_issues": base.get("issues", [])[:3]}
 
@@ -1,7 +1,10 @@
+import hashlib
 import re
 from html.parser import HTMLParser
 from urllib.parse import urlparse
 
+from src.config import CONTENT_LINK_LIMIT, CONTENT_SCAN_BYTES, CONTENT_TEXT_BUDGET
+
 SHORTENER_HOSTS = {
     "bit.ly", "t.co", "tinyurl.com", "goo.gl", "ow.ly", "is.gd", "buff.ly",
     "rebrand.ly", "cutt.ly", "shorturl.at", "rb.gy", "t.ly", "s.id", "lnkd.in",
@@ -11,21 +14,54 @@ UNSUBSCRIBE_WORDS = ("unsubscribe", "abonelikten", "listeden çık", "listeden c
 
 URL_PATTERN = re.compile(r"https?://[^\s<>\"')]+", re.IGNORECASE)
 
+SCAN_CHUNK = 65536
+
+MAGIC = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"PK\x05\x06", "application/zip"),
+    (b"Rar!\x1a\x07", "application/vnd.rar"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+    (b"{\\rtf", "application/rtf"),
+    (b"MZ", "application/x-msdownload"),
+    (b"\x7fELF", "application/x-executable"),
+    (b"BEGIN:VCALENDAR", "text/calendar"),
+)
+
+MAGIC_BYTES = 16
+
 
 class BodyParser(HTMLParser):
     def __init__(self):
         super().__init__(convert_charrefs=True)
         self.text_parts = []
+        self.text_length = 0
         self.links = []
         self.images = []
         self.skip = 0
+        self.truncated = False
 
     def handle_starttag(self, tag, attrs):
-        attributes = dict(attrs)
-
         if tag in ("script", "style"):
             self.skip += 1
-        elif tag == "a" and attributes.get("href"):
+            return
+        if tag not in ("a", "img"):
+            return
+
+        if len(self.links) + len(self.images) >= CONTENT_LINK_LIMIT:
+            self.truncated = True
+            return
+
+        attributes = dict(attrs)
+        if tag == "a" and attributes.get("href"):
             self.links.append(attributes["href"].strip())
         elif tag == "img":
             self.images.append({"src": (attributes.get("src") or "").strip(), "alt": attributes.get("alt")})
@@ -35,44 +71,100 @@ class BodyParser(HTMLParser):
             self.skip -= 1
 
     def handle_data(self, data):
-        if not self.skip:
+        if self.skip:
+            return
+
+        room = CONTENT_TEXT_BUDGET - self.text_length
+        if len(data) > room:
+            self.truncated = True
+            data = data[:max(0, room)]
+
+        if data:
             self.text_parts.append(data)
+            self.text_length += len(data)
+
+    def scan(self, html: str):
+        end = min(len(html), CONTENT_SCAN_BYTES)
+        self.truncated = self.truncated or len(html) > end
+
+        try:
+            for start in range(0, end, SCAN_CHUNK):
+                self.feed(html[start:min(start + SCAN_CHUNK, end)])
+            self.close()
+        except Exception:
+            pass
 
     def text(self):
         return re.sub(r"\s+", " ", "".join(self.text_parts)).strip()
 
 
-def decode_part(part) -> str:
+def decode_part(part) -> tuple:
     try:
-        payload = part.get_payload(decode=True) or b""
-        return payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
+        payload, cut = part.read(CONTENT_SCAN_BYTES)
+        return payload.decode(part.get_content_charset() or "utf-8", errors="ignore"), cut
     except Exception:
-        return ""
+        return "", False
+
 
+def sniff_type(head: bytes):
+    for signature, content_type in MAGIC:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.lstrip()[:5].lower() in (b"<html", b"<!doc"):
+        return "text/html"
+    return None
 
-def extract_bodies(msg):
+
+def attachment_info(part) -> dict:
+    digest = hashlib.sha256()
+    head = b""
+    size = 0
+
+    for chunk in part.chunks():
+        if len(head) < MAGIC_BYTES:
+            head += chunk[:MAGIC_BYTES - len(head)]
+        digest.update(chunk)
+        size += len(chunk)
+
+    return {"name": part.get_filename(), "type": part.get_content_type(), "size": size,
+            "sha256": digest.hexdigest(), "detected_type": sniff_type(head), "defective": part.defective}
+
+
+def plain_urls(plain: str) -> list:
+    urls = []
+
+    for match in URL_PATTERN.finditer(plain):
+        if len(urls) >= CONTENT_LINK_LIMIT:
+            break
+        urls.append(match.group(0))
+
+    return urls
+
+
+def extract_bodies(message):
     plain = ""
     html = ""
     attachments = []
+    truncated = False
 
-    for part in msg.walk() if msg.is_multipart() else [msg]:
-        if part.get_content_maintype() == "multipart":
-            continue
-
+    for part in message.parts():
         disposition = str(part.get("Content-Disposition") or "")
         content_type = part.get_content_type()
 
         if "attachment" in disposition:
-            attachments.append({"name": part.get_filename(), "type": content_type,
-                                "size": len(part.get_payload(decode=True) or b"")})
+            attachments.append(attachment_info(part))
             continue
 
         if content_type == "text/plain" and not plain:
-            plain = decode_part(part)
+            plain, cut = decode_part(part)
+            truncated = truncated or cut
         elif content_type == "text/html" and not html:
-            html = decode_part(part)
+            html, cut = decode_part(part)
+            truncated = truncated or cut
 
-    return plain, html, attachments
+    return plain, html, attachments, truncated
 
 
 def bare_host(host: str) -> str:
@@ -93,27 +185,24 @@ def link_hosts(urls: list) -> list:
     return hosts
 
 
-def inspect_content(msg, subject: str = None) -> dict:
-    plain, html, attachments = extract_bodies(msg)
+def inspect_content(message, subject: str = None) -> dict:
+    plain, html, attachments, truncated = extract_bodies(message)
 
     parser = BodyParser()
     if html:
-        try:
-            parser.feed(html)
-        except Exception:
-            pass
+        parser.scan(html)
 
     html_text = parser.text()
     visible_text = plain.strip() or html_text
-    urls = URL_PATTERN.findall(plain) + [u for u in parser.links if u.lower().startswith("http")]
+    urls = plain_urls(plain) + [u for u in parser.links if u.lower().startswith("http")]
     hosts = link_hosts(urls)
 
     text_length = len(visible_text)
-    html_length = len(html)
+    html_length = min(len(html), CONTENT_SCAN_BYTES)
     images_without_alt = [i for i in parser.images if not (i.get("alt") or "").strip()]
     shorteners = [h for h in hosts if bare_host(h) in SHORTENER_HOSTS]
 
-    body_lower = (plain + " " + html_text).lower()
+    body_lower = (plain[:CONTENT_TEXT_BUDGET] + " " + html_text).lower()
     subject_value = (subject or "").strip()
     letters = [c for c in subject_value if c.isalpha()]
 
@@ -138,4 +227,5 @@ def inspect_content(msg, subject: str = None) -> dict:
         "subject_length": len(subject_value),
         "subject_all_caps": bool(letters) and all(c.isupper() for c in letters),
         "subject_exclamations": subject_value.count("!"),
+        "truncated": truncated or parser.truncated or len(urls) >= CONTENT_LINK_LIMIT,
     }
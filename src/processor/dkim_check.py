@@ -0,0 +1,205 @@
+import base64
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import dkim
+import dns.resolver
+from dkim.util import parse_tag_value
+
+from src.config import DKIM_KEY_CACHE_SIZE, DKIM_MAX_SIGNATURES, DKIM_MIN_KEY_BITS
+from src.processor.message import ParsedMessage
+from src.processor.resolver import get_resolver
+from src.processor.service import domains_aligned
+
+_keys = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hit": 0, "miss": 0}
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats, size=len(_keys))
+
+
+def fetch_key(name: str) -> tuple:
+    try:
+        answers = get_resolver().resolve(name, "TXT")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return None, 0
+
+    for rdata in answers:
+        return b"".join(rdata.strings), getattr(answers, "ttl", 0)
+
+    return None, 0
+
+
+def load_key(selector: str, domain: str):
+    name = f"{selector}._domainkey.{domain}".lower().rstrip(".")
+    now = time.monotonic()
+
+    with _lock:
+        entry = _keys.get(name)
+        if entry is not None and entry[0] > now:
+            _keys.move_to_end(name)
+            _stats["hit"] += 1
+            return entry[1]
+        _stats["miss"] += 1
+
+    record, ttl = fetch_key(name)
+    if record is None:
+        return None
+
+    key = {"record": record.decode("utf-8", errors="replace"), "pk": None, "keysize": None, "ktag": None,
+           "seqtlsrpt": False, "error": None}
+    try:
+        key["pk"], key["keysize"], key["ktag"], key["seqtlsrpt"] = dkim.evaluate_pk(name.encode(), record)
+    except Exception as e:
+        key["error"] = repr(e)
+
+    if ttl > 0:
+        with _lock:
+            _keys[name] = (now + ttl, key)
+            _keys.move_to_end(name)
+            while len(_keys) > DKIM_KEY_CACHE_SIZE:
+                _keys.popitem(last=False)
+
+    return key
+
+
+def get_dkim_tag(record_list: list, tag: str):
+    if not record_list:
+        return None
+
+    joined = " ".join([x.lstrip(" \t").strip() for x in record_list])
+
+    m = re.search(r"(?:^|[;:])\s*" + tag + r"=([^;]+)", joined, flags=re.IGNORECASE)
+    return m.group(1).strip() if m else None
+
+
+def body_hash_key(sig: dict) -> tuple:
+    policy = dkim.CanonicalizationPolicy.from_c_value(sig.get(b"c", b"simple/simple"))
+    return policy.body_algorithm, sig[b"a"], sig.get(b"l")
+
+
+def hash_bodies(body: bytes, signatures: list) -> dict:
+    hashes = {}
+
+    for sig in signatures:
+        try:
+            key = body_hash_key(sig)
+            if key in hashes:
+                continue
+
+            algorithm, hash_name, length = key
+            canonical = algorithm.canonicalize_body(body)
+            if length is not None:
+                canonical = canonical[:int(length)]
+            hashes[key] = dkim.HASH_ALGORITHMS[hash_name](canonical).digest()
+        except Exception:
+            continue
+
+    return hashes
+
+
+def verify_signature(headers: list, body: bytes, idx: int, key: dict, hashes: dict):
+    verifier = dkim.DKIM(None, minkey=DKIM_MIN_KEY_BITS)
+    verifier.headers, verifier.body = headers, body
+    verifier.pk, verifier.keysize, verifier.ktag, verifier.seqtlsrpt = (
+        key["pk"], key["keysize"], key["ktag"], key["seqtlsrpt"])
+
+    sig, include_headers, sigheaders = verifier.verify_headerprep(idx)
+
+    sig = dict(sig)
+    if b"bh" in sig:
+        expected = hashes.get(body_hash_key(sig))
+        if expected is None or base64.b64decode(re.sub(rb"\s+", b"", sig[b"bh"])) != expected:
+            raise dkim.ValidationError("body hash mismatch")
+        del sig[b"bh"]
+
+    return bool(verifier.verify_sig_process(sig, include_headers, sigheaders[idx], None))
+
+
+def check_signature(headers: list, body: bytes, idx: int, content: list, domain: str, hashes: dict) -> dict:
+    check = {"status": "ok", "record": None, "dkim_content": content, "selector": get_dkim_tag(content, "s"),
+             "signing_domain": get_dkim_tag(content, "d"), "algorithm": get_dkim_tag(content, "a"),
+             "key_bits": None, "verified": None, "error": None}
+
+    if not check["selector"]:
+        check["status"] = "broken"
+        return check
+
+    try:
+        key = load_key(check["selector"], check["signing_domain"] or domain)
+    except Exception as e:
+        check["status"] = "unknown"
+        check["error"] = type(e).__name__
+        return check
+
+    if key is None:
+        check["status"] = "no_key"
+        return check
+
+    check["record"] = key["record"]
+    check["key_bits"] = key["keysize"]
+
+    if key["error"]:
+        check["verified"] = False
+        check["error"] = key["error"]
+        return check
+
+    try:
+        check["verified"] = verify_signature(headers, body, idx, key, hashes)
+    except Exception as e:
+        check["verified"] = False
+        check["error"] = repr(e)
+
+    return check
+
+
+def primary(signatures: list, domain: str) -> dict:
+    def rank(check):
+        signing_domain = check["signing_domain"] or ""
+        return (check["verified"] is True, domains_aligned(domain, signing_domain, "s"),
+                domains_aligned(domain, signing_domain, "r"), check["status"] == "ok")
+
+    return max(signatures, key=rank)
+
+
+def check_dkim(domain: str, message: ParsedMessage) -> dict:
+    fields = message.raw_fields("DKIM-Signature")[:max(1, DKIM_MAX_SIGNATURES)]
+
+    check = {"status": "missing", "record": None, "domain": domain, "dkim_content": [],
+             "selector": None, "signing_domain": None, "algorithm": None, "verified": None, "error": None,
+             "signatures": []}
+
+    if not fields:
+        return check
+
+    contents = [[x.lstrip(" \t") for x in bytes(field).decode("utf-8", errors="replace").splitlines()]
+                for field in fields]
+
+    headers, body = dkim.rfc822_parse(message.raw)
+    parsed = []
+    for name, value in headers:
+        if name.lower() == b"dkim-signature" and len(parsed) < len(fields):
+            try:
+                parsed.append(parse_tag_value(value))
+            except Exception:
+                parsed.append({})
+    hashes = hash_bodies(body, [sig for sig in parsed if b"a" in sig])
+
+    def one(idx):
+        return check_signature(headers, body, idx, contents[idx], domain, hashes)
+
+    if len(fields) == 1:
+        signatures = [one(0)]
+    else:
+        with ThreadPoolExecutor(max_workers=len(fields)) as ex:
+            signatures = list(ex.map(one, range(len(fields))))
+
+    check.update(primary(signatures, domain))
+    check["signatures"] = signatures
+    return check
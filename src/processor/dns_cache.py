@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+
+from src.config import DNS_CACHE_SIZE, DNS_CACHE_REDIS_SIZE, DNS_CACHE_MAX_TTL, DNS_NEGATIVE_TTL
+from src.config import DNS_CACHE_SNAPSHOT
+from src.db.cache import get_cache
+
+INDEX_KEY = "mailtester:dns:index"
+TRIM_EVERY = 256
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {"l1_hit": 0, "l1_miss": 0, "l2_hit": 0, "l2_miss": 0, "l2_error": 0, "stored": 0, "evicted": 0}
+
+
+class CachedAnswer(list):
+
+    def __init__(self, rdatas, ttl: int):
+        super().__init__(rdatas)
+        self.ttl = ttl
+
+
+def dns_key(name: str, qtype: str) -> str:
+    return f"mailtester:dns:{qtype.upper()}:{name.rstrip('.').lower()}"
+
+
+def count(name: str, amount: int = 1):
+    with _lock:
+        _stats[name] += amount
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats, l1_size=len(_entries))
+
+
+def negative_ttl(error) -> int:
+    try:
+        if isinstance(error, dns.resolver.NXDOMAIN):
+            responses = list(error.responses().values())
+        else:
+            responses = [error.response()]
+        ttls = [min(rrset.ttl, rrset[0].minimum) for response in responses
+                for rrset in response.authority if rrset.rdtype == dns.rdatatype.SOA]
+    except Exception:
+        ttls = []
+
+    return max(0, min(ttls + [DNS_NEGATIVE_TTL]))
+
+
+def to_entry(outcome, now: float):
+    if isinstance(outcome, dns.resolver.NXDOMAIN):
+        return "nxdomain", None, [], now + negative_ttl(outcome)
+    if isinstance(outcome, dns.resolver.NoAnswer):
+        return "noanswer", None, [], now + negative_ttl(outcome)
+    if isinstance(outcome, BaseException) or outcome.rrset is None:
+        return None
+
+    ttl = min(outcome.chaining_result.minimum_ttl, DNS_CACHE_MAX_TTL)
+    return "answer", dns.rdatatype.to_text(outcome.rrset.rdtype), list(outcome.rrset), now + ttl
+
+
+def from_entry(entry, now: float):
+    kind, _, rdatas, expires_at = entry
+
+    if kind == "nxdomain":
+        return dns.resolver.NXDOMAIN()
+    if kind == "noanswer":
+        return dns.resolver.NoAnswer()
+    return CachedAnswer(rdatas, max(0, int(expires_at - now)))
+
+
+def entry_to_json(entry) -> str:
+    kind, rdtype, rdatas, expires_at = entry
+    return json.dumps({"k": kind, "t": rdtype, "r": [r.to_text() for r in rdatas], "e": expires_at})
+
+
+def entry_from_json(value: str):
+    data = json.loads(value)
+    rdatas = [dns.rdata.from_text(dns.rdataclass.IN, data["t"], text) for text in data["r"]] if data["t"] else []
+    return data["k"], data["t"], rdatas, float(data["e"])
+
+
+def l1_get(key: str, now: float):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[3] <= now:
+            _entries.pop(key, None)
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def l1_put(key: str, entry):
+    if DNS_CACHE_SIZE <= 0:
+        return
+
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > DNS_CACHE_SIZE:
+            _entries.popitem(last=False)
+            _stats["evicted"] += 1
+
+
+def l2_get_many(keys: list) -> list:
+    if DNS_CACHE_REDIS_SIZE <= 0 or not keys:
+        return [None] * len(keys)
+
+    try:
+        values = get_cache().mget(keys)
+    except Exception as e:
+        count("l2_error")
+        print("dns cache okunamadi:", repr(e), flush=True)
+        return [None] * len(keys)
+
+    return [entry_from_json(v) if v else None for v in values]
+
+
+def l2_put_many(items: list, now: float):
+    if DNS_CACHE_REDIS_SIZE <= 0 or not items:
+        return
+
+    try:
+        pipe = get_cache().pipeline(transaction=False)
+        for key, entry in items:
+            pipe.set(key, entry_to_json(entry), ex=max(1, int(entry[3] - now)))
+            pipe.zadd(INDEX_KEY, {key: now})
+
+        with _lock:
+            before = _stats["stored"]
+            _stats["stored"] += len(items)
+            trim = before // TRIM_EVERY != _stats["stored"] // TRIM_EVERY
+
+        if trim:
+            pipe.zcard(INDEX_KEY)
+        results = pipe.execute()
+
+        if trim and results[-1] > DNS_CACHE_REDIS_SIZE:
+            l2_trim(results[-1] - DNS_CACHE_REDIS_SIZE)
+    except Exception as e:
+        count("l2_error")
+        print("dns cache yazilamadi:", repr(e), flush=True)
+
+
+def l2_trim(overflow: int):
+    cache = get_cache()
+    oldest = cache.zpopmin(INDEX_KEY, overflow)
+    if oldest:
+        cache.delete(*[key for key, _ in oldest])
+
+
+def lookup_many(queries: list) -> list:
+    now = time.time()
+    keys = [dns_key(name, qtype) for name, qtype in queries]
+    entries = [l1_get(key, now) for key in keys]
+
+    hits = sum(1 for e in entries if e is not None)
+    count("l1_hit", hits)
+    count("l1_miss", len(keys) - hits)
+
+    missing = [i for i, e in enumerate(entries) if e is None]
+    for i, entry in zip(missing, l2_get_many([keys[i] for i in missing])):
+        if entry is not None and entry[3] > now:
+            entries[i] = entry
+            l1_put(keys[i], entry)
+            count("l2_hit")
+        else:
+            count("l2_miss")
+
+    return [from_entry(e, now) if e is not None else None for e in entries]
+
+
+def store_many(queries: list, outcomes: list) -> list:
+    now = time.time()
+    stored = []
+    served = []
+
+    for (name, qtype), outcome in zip(queries, outcomes):
+        entry = to_entry(outcome, now)
+
+        if entry is None:
+            served.append(outcome)
+            continue
+
+        key = dns_key(name, qtype)
+        l1_put(key, entry)
+        stored.append((key, entry))
+        served.append(from_entry(entry, now))
+
+    l2_put_many(stored, now)
+    return served
+
+
+def save_snapshot(path: str = None):
+    path = path or DNS_CACHE_SNAPSHOT
+    if not path:
+        return
+
+    now = time.time()
+    with _lock:
+        live = [(key, entry) for key, entry in _entries.items() if entry[3] > now]
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump([[key, entry_to_json(entry)] for key, entry in live], f)
+        os.replace(tmp, path)
+    except Exception as e:
+        print("dns cache kaydedilemedi:", path, repr(e), flush=True)
+
+
+def load_snapshot(path: str = None):
+    path = path or DNS_CACHE_SNAPSHOT
+    if not path or not os.path.isfile(path):
+        return
+
+    now = time.time()
+    try:
+        with open(path) as f:
+            for key, value in json.load(f):
+                entry = entry_from_json(value)
+                if entry[3] > now:
+                    l1_put(key, entry)
+    except Exception as e:
+        print("dns cache yuklenemedi:", path, repr(e), flush=True)
@@ -0,0 +1,179 @@
+import math
+import threading
+import time
+
+from src.config import DNSBL_LIFETIME, DNSBL_HEALTH_SAMPLES, DNSBL_HEALTH_REFRESH
+from src.config import DNSBL_BREAKER_MIN_SAMPLES, DNSBL_BREAKER_RATE, DNSBL_BREAKER_COOLDOWN
+from src.config import DNSBL_HEDGE_LISTS, DNSBL_HEDGE_MIN_DELAY
+from src.db.cache import dnsbl_breaker_key, dnsbl_health_key, dnsbl_probe_key, dnsbl_tripped_key, get_cache
+
+FAILED = ("timeout", "blocked", "error")
+
+_view = {}
+_view_lock = threading.Lock()
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def summarize(samples: list) -> dict:
+    parsed = []
+    for sample in samples:
+        status, _, ms = sample.partition(":")
+        try:
+            parsed.append((status, int(ms)))
+        except ValueError:
+            continue
+
+    latencies = [ms for _, ms in parsed]
+    answered = [ms for status, ms in parsed if status not in FAILED]
+    total = len(parsed)
+
+    def rate(status):
+        return round(sum(1 for s, _ in parsed if s == status) / total, 3) if total else None
+
+    return {
+        "samples": total,
+        "p50_ms": percentile(latencies, 0.5),
+        "p90_ms": percentile(latencies, 0.9),
+        "p99_ms": percentile(latencies, 0.99),
+        "answered_p90_ms": percentile(answered, 0.9),
+        "timeout_rate": rate("timeout"),
+        "blocked_rate": rate("blocked"),
+        "error_rate": rate("error"),
+        "failure_rate": round(sum(1 for s, _ in parsed if s in FAILED) / total, 3) if total else None,
+        "last": parsed[0][0] if parsed else None,
+    }
+
+
+def should_open(health: dict) -> bool:
+    if health["half_open"]:
+        return health["last"] in FAILED
+    return (health["samples"] >= DNSBL_BREAKER_MIN_SAMPLES
+            and health["failure_rate"] >= DNSBL_BREAKER_RATE
+            and health["last"] in FAILED)
+
+
+def read_health(dnsbls: list) -> dict:
+    cache = get_cache()
+
+    pipe = cache.pipeline(transaction=False)
+    for dnsbl in dnsbls:
+        pipe.lrange(dnsbl_health_key(dnsbl), 0, DNSBL_HEALTH_SAMPLES - 1)
+        pipe.ttl(dnsbl_breaker_key(dnsbl))
+        pipe.exists(dnsbl_tripped_key(dnsbl))
+    replies = pipe.execute()
+
+    health = {}
+    for i, dnsbl in enumerate(dnsbls):
+        samples, breaker_ttl, tripped = replies[3 * i:3 * i + 3]
+        health[dnsbl] = summarize(samples)
+        health[dnsbl]["open_for"] = breaker_ttl if breaker_ttl and breaker_ttl > 0 else 0
+        health[dnsbl]["half_open"] = bool(tripped) and not health[dnsbl]["open_for"]
+
+    return health
+
+
+def load_health(dnsbls: list) -> dict:
+    health = read_health(dnsbls)
+
+    opening = [d for d in dnsbls if not health[d]["open_for"] and should_open(health[d])]
+    closing = [d for d in dnsbls if health[d]["half_open"] and health[d]["samples"] and d not in opening]
+
+    if opening or closing:
+        pipe = get_cache().pipeline(transaction=False)
+        for dnsbl in opening:
+            pipe.set(dnsbl_breaker_key(dnsbl), str(int(time.time())), ex=DNSBL_BREAKER_COOLDOWN, nx=True)
+            pipe.set(dnsbl_tripped_key(dnsbl), str(int(time.time())), ex=DNSBL_BREAKER_COOLDOWN * 2)
+            pipe.delete(dnsbl_health_key(dnsbl))
+        for dnsbl in closing:
+            pipe.delete(dnsbl_tripped_key(dnsbl))
+        pipe.execute()
+
+    for dnsbl in opening:
+        print("dnsbl devre disi:", dnsbl, health[dnsbl], flush=True)
+        health[dnsbl].update(open_for=DNSBL_BREAKER_COOLDOWN, half_open=False)
+
+    for dnsbl in closing:
+        print("dnsbl tekrar devrede:", dnsbl, flush=True)
+        health[dnsbl]["half_open"] = False
+
+    return health
+
+
+def claim_probe(dnsbl: str) -> bool:
+    try:
+        return bool(get_cache().set(dnsbl_probe_key(dnsbl), "1", ex=max(1, math.ceil(DNSBL_LIFETIME * 2)), nx=True))
+    except Exception as e:
+        print("dnsbl denemesi ayrilamadi:", dnsbl, repr(e), flush=True)
+        return True
+
+
+def current_health(dnsbls: list) -> dict:
+    key = tuple(dnsbls)
+    now = time.monotonic()
+
+    with _view_lock:
+        cached = _view.get(key)
+
+    if cached and now - cached[0] < DNSBL_HEALTH_REFRESH:
+        return cached[1]
+
+    try:
+        health = load_health(dnsbls)
+    except Exception as e:
+        print("dnsbl sagligi okunamadi:", repr(e), flush=True)
+        health = {}
+
+    with _view_lock:
+        _view[key] = (now, health)
+
+    return health
+
+
+def expected_ms(health: dict, field: str, default: int) -> int:
+    value = (health or {}).get(field)
+    return default if value is None else value
+
+
+def plan(dnsbls: list) -> tuple:
+    health = current_health(dnsbls)
+    default_ms = int(DNSBL_LIFETIME * 500)
+
+    def live(dnsbl):
+        state = health.get(dnsbl) or {}
+        if state.get("open_for"):
+            return False
+        if state.get("half_open") and not state.get("samples"):
+            return claim_probe(dnsbl)
+        return True
+
+    active = [d for d in dnsbls if live(d)]
+    skipped = [d for d in dnsbls if d not in active]
+    active.sort(key=lambda d: expected_ms(health.get(d), "p50_ms", default_ms))
+
+    hedge = {}
+    for dnsbl in active:
+        if dnsbl in DNSBL_HEDGE_LISTS:
+            hedge[dnsbl] = max(DNSBL_HEDGE_MIN_DELAY, expected_ms(health.get(dnsbl), "answered_p90_ms", default_ms) / 1000.0)
+
+    return active, skipped, hedge
+
+
+def record(samples: list):
+    if not samples:
+        return
+
+    try:
+        pipe = get_cache().pipeline(transaction=False)
+        for dnsbl, status, seconds in samples:
+            key = dnsbl_health_key(dnsbl)
+            pipe.lpush(key, f"{status}:{int(seconds * 1000)}")
+            pipe.ltrim(key, 0, DNSBL_HEALTH_SAMPLES - 1)
+        pipe.execute()
+    except Exception as e:
+        print("dnsbl sagligi yazilamadi:", repr(e), flush=True)
@@ -1,9 +1,43 @@
+import hashlib
+import hmac
 import secrets
+from datetime import datetime
 
-from src.config import MAIL_DOMAIN
+from src.config import MAIL_DOMAIN, SECRET_KEY, SIGNED_ADDRESSES
 
+SIGNATURE_LENGTH = 16
 
-def generate_random_email():
+
+def address_signature(token: str, expires: int, domain: str) -> str:
+    message = f"{token}.{expires}@{domain.lower()}".encode()
+    return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:SIGNATURE_LENGTH]
+
+
+def generate_random_email(expires_at: datetime = None):
     token = "test" + "-" + secrets.token_hex(10)
+
+    if SIGNED_ADDRESSES and SECRET_KEY and expires_at is not None:
+        expires = int(expires_at.timestamp())
+        token = f"{token}-{expires:x}-{address_signature(token, expires, MAIL_DOMAIN)}"
+
     test_mail = token + "@" + MAIL_DOMAIN
     return test_mail
+
+
+def signed_expiry(address: str):
+    local, _, domain = (address or "").strip().lower().rpartition("@")
+    parts = local.split("-")
+
+    if not SECRET_KEY or len(parts) != 4 or parts[0] != "test" or len(parts[3]) != SIGNATURE_LENGTH:
+        return None
+
+    try:
+        expires = int(parts[2], 16)
+    except ValueError:
+        return 0
+
+    expected = address_signature(f"{parts[0]}-{parts[1]}", expires, domain)
+    if domain != (MAIL_DOMAIN or "").lower() or not hmac.compare_digest(expected, parts[3]):
+        return 0
+
+    return expires
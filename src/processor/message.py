@@ -0,0 +1,255 @@
+import binascii
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from functools import cached_property
+
+CHUNK_SIZE = 65536
+MAX_DEPTH = 20
+BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+NOT_BASE64 = bytes(b for b in range(256) if b not in BASE64_ALPHABET)
+
+
+def decode_header_value(value):
+    if not value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def index_headers(raw: bytes) -> tuple:
+    fields = []
+    position = 0
+
+    while position < len(raw):
+        end = raw.find(b"\n", position)
+        end = len(raw) if end < 0 else end + 1
+        line = raw[position:end]
+
+        if line in (b"\r\n", b"\n"):
+            return fields, position, end
+
+        if line[:1] in (b" ", b"\t") and fields:
+            fields[-1][2] = end
+        elif b":" in line:
+            fields.append([line.split(b":", 1)[0].strip().decode("ascii", errors="replace"), position, end])
+        else:
+            return fields, position, position
+
+        position = end
+
+    return fields, len(raw), len(raw)
+
+
+def split_part(raw: bytes, start: int, end: int) -> tuple:
+    if raw.startswith(b"\n", start):
+        return start, start + 1
+    if raw.startswith(b"\r\n", start):
+        return start, start + 2
+
+    blank = [(found + 1, found + skip) for found, skip in
+             ((raw.find(b"\n\n", start, end), 2), (raw.find(b"\n\r\n", start, end), 3)) if found >= 0]
+    return min(blank) if blank else (end, end)
+
+
+def base64_chunks(raw: bytes, start: int, end: int, size: int):
+    carry = b""
+
+    for position in range(start, end, size):
+        data = carry + raw[position:min(position + size, end)].translate(None, NOT_BASE64)
+        usable = len(data) - len(data) % 4
+        carry = data[usable:]
+        if usable:
+            yield binascii.a2b_base64(data[:usable])
+
+    carry = carry.rstrip(b"=")
+    stray = carry[-1:] if len(carry) % 4 == 1 else b""
+    carry = carry[:len(carry) - len(stray)]
+    if carry:
+        yield binascii.a2b_base64(carry + b"=" * (-len(carry) % 4))
+    if stray:
+        raise binascii.Error("stray base64 character")
+
+
+def qp_chunks(raw: bytes, start: int, end: int, size: int):
+    position = start
+
+    while position < end:
+        stop = min(position + size, end)
+        if stop < end:
+            newline = raw.rfind(b"\n", position, stop)
+            if newline >= position:
+                stop = newline + 1
+            else:
+                escape = raw.rfind(b"=", stop - 2, stop)
+                stop = escape if escape > position else stop
+
+        yield binascii.a2b_qp(raw[position:stop])
+        position = stop
+
+
+def plain_chunks(raw: bytes, start: int, end: int, size: int):
+    for position in range(start, end, size):
+        yield raw[position:min(position + size, end)]
+
+
+DECODERS = {"base64": base64_chunks, "quoted-printable": qp_chunks}
+
+
+class MimePart:
+
+    def __init__(self, raw: bytes, headers, start: int, end: int):
+        self.raw = raw
+        self.headers = headers
+        self.start = start
+        self.end = end
+        self.defective = False
+
+    def get(self, name: str, failobj=None):
+        return self.headers.get(name, failobj)
+
+    def get_content_type(self) -> str:
+        return self.headers.get_content_type()
+
+    def get_content_charset(self, failobj=None):
+        return self.headers.get_content_charset(failobj)
+
+    def get_filename(self, failobj=None):
+        return self.headers.get_filename(failobj)
+
+    @property
+    def encoding(self) -> str:
+        return str(self.headers.get("Content-Transfer-Encoding") or "").strip().lower()
+
+    def chunks(self, size: int = CHUNK_SIZE):
+        decoder = DECODERS.get(self.encoding, plain_chunks)
+        try:
+            for chunk in decoder(self.raw, self.start, self.end, size):
+                if chunk:
+                    yield chunk
+        except (binascii.Error, ValueError):
+            self.defective = True
+
+    def read(self, limit: int) -> tuple:
+        data = bytearray()
+
+        for chunk in self.chunks():
+            data += chunk
+            if len(data) > limit:
+                return bytes(data[:limit]), True
+
+        return bytes(data), False
+
+
+def boundaries(raw: bytes, delimiter: bytes, start: int, end: int):
+    position = start
+    part_start = None
+
+    while position < end:
+        found = raw.find(delimiter, position, end)
+        if found < 0:
+            break
+
+        tail = raw[found + len(delimiter):found + len(delimiter) + 2]
+        line_start = found == start or raw[found - 1] == 0x0A
+        if not line_start or not (tail == b"--" or tail[:1] in (b"", b" ", b"\t", b"\r", b"\n")):
+            position = found + 1
+            continue
+
+        if part_start is not None:
+            part_end = found - 2 if raw.startswith(b"\r\n", found - 2) and found - 2 >= part_start else found - 1
+            yield part_start, max(part_start, part_end)
+
+        closing = tail == b"--"
+        newline = raw.find(b"\n", found + len(delimiter), end)
+        if closing or newline < 0:
+            return
+
+        part_start = position = newline + 1
+
+    if part_start is not None:
+        yield part_start, end
+
+
+def walk_parts(raw: bytes, headers, start: int, end: int, depth: int = 0):
+    content_type = headers.get_content_type()
+    boundary = headers.get_boundary() if content_type.startswith("multipart/") else None
+
+    if boundary and depth < MAX_DEPTH:
+        delimiter = b"--" + boundary.encode("ascii", errors="ignore")
+        for part_start, part_end in boundaries(raw, delimiter, start, end):
+            header_end, body_start = split_part(raw, part_start, part_end)
+            part_headers = BytesHeaderParser().parsebytes(raw[part_start:header_end])
+            yield from walk_parts(raw, part_headers, body_start, part_end, depth + 1)
+        return
+
+    if content_type.startswith("multipart/"):
+        return
+
+    disposition = str(headers.get("Content-Disposition") or "").lower()
+    transfer = str(headers.get("Content-Transfer-Encoding") or "").strip().lower()
+    if (content_type == "message/rfc822" and "attachment" not in disposition
+            and transfer in ("", "7bit", "8bit", "binary") and depth < MAX_DEPTH):
+        header_end, body_start = split_part(raw, start, end)
+        inner = BytesHeaderParser().parsebytes(raw[start:header_end])
+        yield from walk_parts(raw, inner, body_start, end, depth + 1)
+        return
+
+    yield MimePart(raw, headers, start, end)
+
+
+class ParsedMessage:
+
+    def __init__(self, raw: bytes):
+        self.raw = bytes(raw)
+        self.view = memoryview(self.raw)
+        fields, self.header_end, self.body_start = index_headers(self.raw)
+
+        self.fields = tuple((name, start, end) for name, start, end in fields)
+        self.index = {}
+        for position, (name, _, _) in enumerate(self.fields):
+            self.index.setdefault(name.lower(), []).append(position)
+
+    @property
+    def header_block(self) -> memoryview:
+        return self.view[:self.header_end]
+
+    @property
+    def body(self) -> memoryview:
+        return self.view[self.body_start:]
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self.index
+
+    def raw_fields(self, name: str) -> list:
+        return [self.view[self.fields[i][1]:self.fields[i][2]] for i in self.index.get(name.lower(), [])]
+
+    def value(self, position: int) -> str:
+        name, start, end = self.fields[position]
+        field = bytes(self.view[start:end]).decode("utf-8", errors="replace")
+        return field.split(":", 1)[1].lstrip(" \t").rstrip("\r\n")
+
+    def get_all(self, name: str, failobj=None) -> list:
+        positions = self.index.get(name.lower())
+        if not positions:
+            return failobj
+        return [self.value(i) for i in positions]
+
+    def get(self, name: str, failobj=None):
+        positions = self.index.get(name.lower())
+        return self.value(positions[0]) if positions else failobj
+
+    def decoded(self, name: str):
+        return decode_header_value(self.get(name))
+
+    @cached_property
+    def headers(self):
+        return BytesHeaderParser().parsebytes(bytes(self.header_block))
+
+    def parts(self):
+        yield from walk_parts(self.raw, self.headers, self.body_start, len(self.raw))
+
+    @cached_property
+    def text(self) -> str:
+        return self.raw.decode("utf-8", errors="replace")
@@ -0,0 +1,26 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.config import ANALYZE_CONCURRENCY
+
+
+def run_steps(steps: dict, max_workers: int = None) -> dict:
+    pending = dict(steps)
+    results = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers or ANALYZE_CONCURRENCY or len(steps))) as ex:
+        while pending or running:
+            for name, (needs, func) in list(pending.items()):
+                if all(need in results for need in needs):
+                    running[ex.submit(func, *[results[need] for need in needs])] = name
+                    del pending[name]
+
+            if not running:
+                raise RuntimeError("unresolvable step inputs: " + ", ".join(sorted(pending)))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                results[running.pop(fut)] = fut.result()
+
+    return results
@@ -0,0 +1,89 @@
+import os
+import threading
+from functools import lru_cache
+
+from src.config import PSL_CACHE_SIZE, PSL_PATH
+
+BUNDLED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public_suffix_list.dat")
+RULE = "$"
+EXCEPTION = "!"
+WILDCARD = "*"
+
+_trie = {}
+_lock = threading.Lock()
+
+
+def ascii_label(label: str) -> str:
+    try:
+        return label.encode("idna").decode("ascii")
+    except Exception:
+        return label
+
+
+def insert(trie: dict, labels: list, flag: str):
+    node = trie
+    for label in reversed(labels):
+        node = node.setdefault(label, {})
+    node[flag] = True
+
+
+def build(path: str) -> dict:
+    trie = {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            rule = line.split(None, 1)[0] if line.strip() else ""
+            if not rule or rule.startswith("//"):
+                continue
+
+            flag = EXCEPTION if rule.startswith("!") else RULE
+            labels = rule.lstrip("!").lower().split(".")
+
+            insert(trie, labels, flag)
+            encoded = [ascii_label(label) for label in labels]
+            if encoded != labels:
+                insert(trie, encoded, flag)
+
+    return trie
+
+
+def suffix_trie() -> dict:
+    if not _trie:
+        with _lock:
+            if not _trie:
+                path = PSL_PATH or BUNDLED_PATH
+                try:
+                    _trie.update(build(path))
+                except Exception as e:
+                    print("public suffix listesi okunamadi:", path, repr(e), flush=True)
+                    _trie[WILDCARD] = {RULE: True}
+    return _trie
+
+
+def suffix_length(labels: list) -> int:
+    node = suffix_trie()
+    length = 1
+
+    for depth, label in enumerate(reversed(labels), 1):
+        child = node.get(label)
+        if child is not None and child.get(EXCEPTION):
+            return depth - 1
+
+        wildcard = node.get(WILDCARD)
+        if (child is not None and child.get(RULE)) or (wildcard is not None and wildcard.get(RULE)):
+            length = depth
+
+        node = child if child is not None else wildcard
+        if node is None:
+            break
+
+    return length
+
+
+@lru_cache(maxsize=PSL_CACHE_SIZE)
+def organizational_domain(domain: str) -> str:
+    labels = (domain or "").strip(".").lower().split(".")
+    if len(labels) < 2:
+        return (domain or "").lower()
+
+    return ".".join(labels[-(suffix_length(labels) + 1):])
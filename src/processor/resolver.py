@@ -0,0 +1,155 @@
+import asyncio
+import os
+import socket
+import threading
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+from src.config import DNS_RESOLVER, DNS_TIMEOUT, DNS_LIFETIME, DNS_MAX_INFLIGHT
+from src.processor.dns_cache import CachedAnswer, lookup_many, store_many
+
+DEFINITE = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+
+_resolver_ip = {}
+_loop = {}
+_loop_lock = threading.Lock()
+
+
+def get_resolver_ip():
+    if not DNS_RESOLVER:
+        return None
+
+    if "ip" not in _resolver_ip:
+        try:
+            _resolver_ip["ip"] = socket.gethostbyname(DNS_RESOLVER)
+        except Exception as e:
+            print("dns resolver adresi çözülemedi:", DNS_RESOLVER, repr(e), flush=True)
+            _resolver_ip["ip"] = None
+
+    return _resolver_ip["ip"]
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    with _loop_lock:
+        if _loop.get("pid") != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="dns-loop", daemon=True).start()
+            _loop.clear()
+            _loop.update(pid=os.getpid(), loop=loop, resolvers={}, inflight=asyncio.Semaphore(max(1, DNS_MAX_INFLIGHT)))
+
+        return _loop["loop"]
+
+
+def async_resolver(timeout: float, lifetime: float) -> dns.asyncresolver.Resolver:
+    resolvers = _loop["resolvers"]
+
+    if (timeout, lifetime) not in resolvers:
+        resolver_ip = get_resolver_ip()
+
+        resolver = dns.asyncresolver.Resolver(configure=not resolver_ip)
+        if resolver_ip:
+            resolver.nameservers = [resolver_ip]
+
+        resolver.timeout = timeout
+        resolver.lifetime = lifetime
+        resolvers[(timeout, lifetime)] = resolver
+
+    return resolvers[(timeout, lifetime)]
+
+
+async def aresolve(name: str, qtype: str, timeout: float, lifetime: float, budget: float = None):
+    async with _loop["inflight"]:
+        return await async_resolver(timeout, lifetime).resolve(name, qtype, lifetime=budget)
+
+
+async def ahedged(name: str, qtype: str, timeout: float, lifetime: float, delay: float):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + lifetime
+
+    tasks = [asyncio.ensure_future(aresolve(name, qtype, timeout, lifetime))]
+    done, _ = await asyncio.wait(tasks, timeout=delay)
+
+    remaining = deadline - loop.time()
+    if not done and remaining > 0.05:
+        tasks.append(asyncio.ensure_future(aresolve(name, qtype, timeout, lifetime, remaining)))
+
+    pending = set(tasks)
+    error = None
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                if isinstance(task.exception(), DEFINITE):
+                    raise task.exception()
+                error = error or task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    raise error or dns.exception.Timeout()
+
+
+async def aresolve_all(queries: list, timeout: float, lifetime: float, concurrency: int = None,
+                       hedge: dict = None) -> list:
+    limit = asyncio.Semaphore(max(1, concurrency or len(queries)))
+    loop = asyncio.get_running_loop()
+
+    async def one(name: str, qtype: str):
+        async with limit:
+            started = loop.time()
+            try:
+                if (hedge or {}).get(name):
+                    outcome = await ahedged(name, qtype, timeout, lifetime, hedge[name])
+                else:
+                    outcome = await aresolve(name, qtype, timeout, lifetime)
+            except Exception as e:
+                outcome = e
+            return outcome, loop.time() - started
+
+    return await asyncio.gather(*[one(name, qtype) for name, qtype in queries])
+
+
+def run(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+class Resolver:
+
+    def __init__(self, timeout: float = None, lifetime: float = None):
+        self.timeout = timeout or DNS_TIMEOUT
+        self.lifetime = lifetime or DNS_LIFETIME
+        self.elapsed = {}
+
+    def resolve(self, name: str, qtype: str = "A") -> CachedAnswer:
+        outcome = self.resolve_many([(name, qtype)])[0]
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def resolve_many(self, queries: list, concurrency: int = None, hedge: dict = None) -> list:
+        if not queries:
+            return []
+
+        outcomes = lookup_many(queries)
+        missing = [i for i, outcome in enumerate(outcomes) if outcome is None]
+
+        if missing:
+            asked = [queries[i] for i in missing]
+            fresh = run(aresolve_all(asked, self.timeout, self.lifetime, concurrency, hedge))
+            self.elapsed.update((name, seconds) for (name, _), (_, seconds) in zip(asked, fresh))
+            for i, outcome in zip(missing, store_many(asked, [outcome for outcome, _ in fresh])):
+                outcomes[i] = outcome
+
+        return outcomes
+
+
+def get_resolver(timeout: float = None, lifetime: float = None) -> Resolver:
+    return Resolver(timeout, lifetime)
@@ -1,43 +1,33 @@
+import hashlib
 import ipaddress
+import json
 import re
-import socket
+import threading
 import dns.resolver
 import smtplib
-import dkim
 import spf
 
 
 from src.config import DNSBL_TIMEOUT, DNSBL_LIFETIME, DNSBL_MAX_LISTS, DNSBL_CONCURRENCY
-from src.config import DNS_RESOLVER, DNS_TIMEOUT, DNS_LIFETIME
-from src.config import SPF_TIMEOUT, DKIM_MIN_KEY_BITS, URIBL_MAX_DOMAINS
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.config import DNSBL_TTL_LISTED, DNSBL_TTL_NOT_LISTED, DNSBL_TTL_BLOCKED, DNSBL_TTL_TIMEOUT
+from src.config import SPF_TIMEOUT, URIBL_MAX_DOMAINS, DNS_CACHE_MAX_TTL, DNS_NEGATIVE_TTL
+from src.db.cache import dnsbl_key, get_cache, spf_result_key, spf_tree_key
+from src.processor import dnsbl_health
+from src.processor.psl import organizational_domain
+from src.processor.resolver import get_resolver
 
-_resolver_ip = {}
 
-def get_resolver_ip():
-    if not DNS_RESOLVER:
-        return None
-
-    if "ip" not in _resolver_ip:
-        try:
-            _resolver_ip["ip"] = socket.gethostbyname(DNS_RESOLVER)
-        except Exception as e:
-            print("dns resolver adresi çözülemedi:", DNS_RESOLVER, repr(e), flush=True)
-            _resolver_ip["ip"] = None
+SPF_LOOKUP_LIMIT = 10
+SPF_MAX_DEPTH = 10
+SPF_LOOKUP_TERMS = ("include", "a", "mx", "ptr", "exists", "redirect")
 
-    return _resolver_ip["ip"]
+_spf_ttls = threading.local()
 
 
-def get_resolver(timeout: float = None, lifetime: float = None) -> dns.resolver.Resolver:
-    resolver_ip = get_resolver_ip()
-
-    resolver = dns.resolver.Resolver(configure=not resolver_ip)
-    if resolver_ip:
-        resolver.nameservers = [resolver_ip]
-
-    resolver.timeout = timeout or DNS_TIMEOUT
-    resolver.lifetime = lifetime or DNS_LIFETIME
-    return resolver
+def note_spf_ttl(ttl: int):
+    ttls = getattr(_spf_ttls, "values", None)
+    if ttls is not None:
+        ttls.append(ttl)
 
 
 def spf_dns_lookup(name, qtype, tcpfallback=True, timeout=30):
@@ -46,10 +36,13 @@ def spf_dns_lookup(name, qtype, tcpfallback=True, timeout=30):
     try:
         answers = get_resolver().resolve(name, qtype)
     except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+        note_spf_ttl(DNS_NEGATIVE_TTL)
         return records
     except (dns.resolver.NoNameservers, dns.exception.Timeout) as e:
         raise spf.TempError("DNS " + str(e))
 
+    note_spf_ttl(getattr(answers, "ttl", DNS_CACHE_MAX_TTL))
+
     for rdata in answers:
         if qtype in ("A", "AAAA"):
             records.append(((name, qtype), rdata.address))
@@ -63,161 +56,168 @@ def spf_dns_lookup(name, qtype, tcpfallback=True, timeout=30):
     return records
 
 
-def dkim_dns_lookup(name, timeout=5):
-    if isinstance(name, bytes):
-        name = name.decode("ascii", errors="ignore")
+spf.DNSLookup = spf_dns_lookup
+
 
+def spf_records(domain: str) -> tuple:
     try:
-        answers = get_resolver().resolve(name.rstrip("."), "TXT")
+        answers = get_resolver().resolve(domain, "TXT")
     except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-        return None
+        return False, [], DNS_NEGATIVE_TTL
     except Exception:
-        raise
+        return None, [], 0
 
-    for rdata in answers:
-        return b"".join(rdata.strings)
+    spf_list = [record for record in (_txt_to_str(r) for r in answers) if record.lower().startswith("v=spf1")]
+    return bool(spf_list), spf_list, getattr(answers, "ttl", DNS_CACHE_MAX_TTL)
 
-    return None
 
+def spf_term(term: str) -> tuple:
+    term = term.lower()
+    qualifier = term[0] if term[:1] in "+-~?" else ""
+    body = term[len(qualifier):]
 
-def dkim_key_lookup(name):
-    try:
-        return dkim_dns_lookup(name), None
-    except Exception as e:
-        return None, type(e).__name__
+    if "=" in body and body.split("=", 1)[0].isalpha():
+        name, value = body.split("=", 1)
+        return qualifier, name, value
 
-
-spf.DNSLookup = spf_dns_lookup
+    name = re.split(r"[:/]", body, maxsplit=1)[0]
+    value = body[len(name) + 1:] if body[len(name):len(name) + 1] == ":" else ""
+    return qualifier, name, value
 
 
-def check_spf_record(domain: str):
-    try:
-        records = get_resolver().resolve(domain, "TXT")
-    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-        return False, []
-    except Exception:
-        return None, []
+def expand_spf(domain: str, depth: int = 0, path: tuple = ()) -> dict:
+    domain = domain.strip(".").lower()
+    node = {"domain": domain, "record": None, "records": [], "mechanisms": [], "includes": [], "lookups": 0,
+            "ttl": DNS_CACHE_MAX_TTL, "error": None}
 
-    spf_list = []
-    for r in records:
-        record = _txt_to_str(r)
-        if record.lower().startswith("v=spf1"):
-            spf_list.append(record)
+    if domain in path or depth > SPF_MAX_DEPTH:
+        node["error"] = "loop" if domain in path else "too_deep"
+        return node
 
-    if spf_list != []:
-        return True, spf_list
-    else:
-        return False, spf_list
+    found, records, ttl = spf_records(domain)
+    node["ttl"] = min(node["ttl"], ttl)
 
-def _as_raw_string(msg_or_raw) -> str:
+    if found is None:
+        node["error"] = "temperror"
+        return node
+    if not found:
+        node["error"] = "none"
+        return node
+    if len(records) > 1:
+        node["error"] = "multiple_records"
+
+    node["record"] = records[0]
+    node["records"] = records
+
+    for term in records[0].split()[1:]:
+        qualifier, name, value = spf_term(term)
+        node["mechanisms"].append({"qualifier": qualifier or "+", "name": name, "value": value})
+
+        if name not in SPF_LOOKUP_TERMS:
+            continue
 
-    if isinstance(msg_or_raw, str):
-        return msg_or_raw
-    if hasattr(msg_or_raw, "as_string"):
-        return msg_or_raw.as_string()
-    return str(msg_or_raw)
+        node["lookups"] += 1
 
-def get_dkim_content(msg_raw: str):
-    msg_raw = _as_raw_string(msg_raw)
-    msg_list = msg_raw.splitlines()
+        if name in ("include", "redirect") and value:
+            if "%" in value:
+                node["includes"].append({"domain": value, "dynamic": True, "lookups": 0})
+                continue
 
-    record_list = []
-    in_dkim = False
+            child = expand_spf(value, depth + 1, path + (domain,))
+            node["includes"].append(child)
+            node["lookups"] += child["lookups"]
+            node["ttl"] = min(node["ttl"], child["ttl"])
 
-    for line in msg_list:
-        if line == "":
-            break
+    return node
 
-        if line.lower().startswith("dkim-signature:"):
-            in_dkim = True
-            record_list.append(line)
-            continue
 
-        if in_dkim and line.startswith(("\t", " ")):
-            record_list.append(line)
-            continue
+def has_temperror(node: dict) -> bool:
+    return node.get("error") == "temperror" or any(has_temperror(child) for child in node.get("includes", []))
 
-        if in_dkim:
-            break
 
-    return record_list
+def spf_tree(domain: str) -> dict:
+    key = spf_tree_key(domain)
 
+    try:
+        cached = get_cache().get(key)
+        if cached:
+            return json.loads(cached)
+    except Exception as e:
+        print("spf agaci okunamadi:", domain, repr(e), flush=True)
 
-def get_dkim_tag(record_list: list, tag: str):
-    if not record_list:
-        return None
+    tree = expand_spf(domain)
 
-    joined = " ".join([x.lstrip(" \t").strip() for x in record_list])
+    if tree["ttl"] > 0 and not has_temperror(tree):
+        try:
+            get_cache().set(key, json.dumps(tree), ex=tree["ttl"])
+        except Exception as e:
+            print("spf agaci yazilamadi:", domain, repr(e), flush=True)
 
-    m = re.search(r"(?:^|[;:])\s*" + tag + r"=([^;]+)", joined, flags=re.IGNORECASE)
-    return m.group(1).strip() if m else None
+    return tree
 
 
-def check_spf(domain: str, sender_ip: str = None, envelope_from: str = None, helo: str = None) -> dict:
-    found, records = check_spf_record(domain)
+def lookup_budget(tree: dict) -> dict:
+    def flatten(node):
+        yield {"domain": node["domain"], "lookups": node.get("lookups", 0), "error": node.get("error"),
+               "dynamic": node.get("dynamic", False)}
+        for child in node.get("includes", []):
+            yield from flatten(child)
 
-    check = {"status": "ok" if found else "unknown" if found is None else "missing",
-             "record": records, "domain": domain,
-             "result": None, "explanation": None, "checked_ip": sender_ip, "checked_sender": None}
+    return {"used": tree["lookups"], "limit": SPF_LOOKUP_LIMIT, "exceeded": tree["lookups"] > SPF_LOOKUP_LIMIT,
+            "chain": list(flatten(tree))}
 
-    if not found or not sender_ip:
-        return check
 
-    check["checked_sender"] = envelope_from or f"postmaster@{domain}"
+def evaluate_spf(sender_ip: str, sender: str, helo: str) -> tuple:
+    digest = hashlib.sha256(json.dumps([sender_ip, sender.lower(), helo.lower()]).encode()).hexdigest()
+    key = spf_result_key(digest)
 
     try:
-        result, explanation = spf.check2(i=sender_ip, s=check["checked_sender"], h=helo or domain, timeout=SPF_TIMEOUT)
+        cached = get_cache().get(key)
+        if cached:
+            return tuple(json.loads(cached))
     except Exception as e:
-        check["result"] = "temperror"
-        check["explanation"] = repr(e)
-        return check
+        print("spf sonucu okunamadi:", repr(e), flush=True)
 
-    check["result"] = result
-    check["explanation"] = explanation
-    return check
-
-
-def check_dkim(domain: str, raw_email) -> dict:
-    raw_bytes = raw_email if isinstance(raw_email, bytes) else _as_raw_string(raw_email).encode("utf-8", errors="replace")
-    dkim_content = get_dkim_content(raw_bytes.decode("utf-8", errors="replace"))
-    clean_dkim_content = [x.lstrip(" \t") for x in dkim_content] if dkim_content else []
-
-    check = {"status": "missing", "record": None, "domain": domain, "dkim_content": clean_dkim_content,
-             "selector": None, "signing_domain": None, "algorithm": None, "verified": None, "error": None}
-
-    if not dkim_content:
-        return check
+    _spf_ttls.values = []
+    try:
+        result, explanation = spf.check2(i=sender_ip, s=sender, h=helo, timeout=SPF_TIMEOUT)
+        ttl = min(_spf_ttls.values + [DNS_CACHE_MAX_TTL])
+    finally:
+        _spf_ttls.values = None
 
-    check["selector"] = get_dkim_tag(clean_dkim_content, "s")
-    check["signing_domain"] = get_dkim_tag(clean_dkim_content, "d")
-    check["algorithm"] = get_dkim_tag(clean_dkim_content, "a")
+    if result != "temperror" and ttl > 0:
+        try:
+            get_cache().set(key, json.dumps([result, explanation]), ex=ttl)
+        except Exception as e:
+            print("spf sonucu yazilamadi:", repr(e), flush=True)
 
-    if not check["selector"]:
-        check["status"] = "broken"
-        return check
+    return result, explanation
 
-    signing_domain = check["signing_domain"] or domain
 
-    record, lookup_error = dkim_key_lookup(f"{check['selector']}._domainkey.{signing_domain}")
+def check_spf(domain: str, sender_ip: str = None, envelope_from: str = None, helo: str = None) -> dict:
+    tree = spf_tree(domain)
+    found = None if tree["error"] == "temperror" else tree["error"] != "none"
+    records = tree.get("records") or ([tree["record"]] if tree["record"] else [])
 
-    if lookup_error:
-        check["status"] = "unknown"
-        check["error"] = lookup_error
-        return check
+    check = {"status": "ok" if found else "unknown" if found is None else "missing",
+             "record": records, "domain": domain, "multiple_records": len(records) > 1,
+             "result": None, "explanation": None, "checked_ip": sender_ip, "checked_sender": None,
+             "lookup_budget": lookup_budget(tree) if found else None}
 
-    if not record:
-        check["status"] = "no_key"
+    if not found or not sender_ip:
         return check
 
-    check["record"] = record.decode("utf-8", errors="replace")
-    check["status"] = "ok"
+    check["checked_sender"] = envelope_from or f"postmaster@{domain}"
 
     try:
-        check["verified"] = bool(dkim.verify(raw_bytes, dnsfunc=dkim_dns_lookup, minkey=DKIM_MIN_KEY_BITS))
+        result, explanation = evaluate_spf(sender_ip, check["checked_sender"], helo or domain)
     except Exception as e:
-        check["verified"] = False
-        check["error"] = repr(e)
+        check["result"] = "temperror"
+        check["explanation"] = repr(e)
+        return check
 
+    check["result"] = result
+    check["explanation"] = explanation
     return check
 
 
@@ -227,11 +227,6 @@ def _txt_to_str(rdata) -> str:
     except Exception:
         return str(rdata).strip('"')
 
-def organizational_domain(domain: str) -> str:
-    labels = (domain or "").strip(".").lower().split(".")
-    return ".".join(labels[-2:]) if len(labels) >= 2 else (domain or "").lower()
-
-
 def domains_aligned(from_domain: str, auth_domain: str, mode: str) -> bool:
     if not from_domain or not auth_domain:
         return False
@@ -260,23 +255,24 @@ def parse_dmarc_tags(record: str) -> dict:
 
 
 def check_dmarc_record(domain: str):
-    candidate = (domain or "").strip(".")
+    domain = (domain or "").strip(".").lower()
+    if domain.count(".") < 1:
+        return False, None, None
+
+    candidates = list(dict.fromkeys([domain, organizational_domain(domain)]))
+    outcomes = get_resolver().resolve_many([(f"_dmarc.{candidate}", "TXT") for candidate in candidates])
     failed = False
 
-    while candidate.count(".") >= 1:
-        try:
-            answers = get_resolver().resolve(f"_dmarc.{candidate}", "TXT")
-            record = next((t for t in [_txt_to_str(r) for r in answers] if t.lower().startswith("v=dmarc1")), None)
-            if record:
-                return True, record, candidate
-        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-            pass
-        except Exception:
+    for candidate, outcome in zip(candidates, outcomes):
+        if isinstance(outcome, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+            continue
+        if isinstance(outcome, BaseException):
             failed = True
+            continue
 
-        if candidate.count(".") == 1:
-            break
-        candidate = candidate.split(".", 1)[1]
+        record = next((t for t in [_txt_to_str(r) for r in outcome] if t.lower().startswith("v=dmarc1")), None)
+        if record:
+            return True, record, candidate
 
     return (None if failed else False), None, None
 
@@ -372,6 +368,89 @@ DNSBL_LISTS = [
     "all.s5h.net",
 ]
 
+def _dnsbl_outcome(outcome) -> tuple:
+    if isinstance(outcome, dns.resolver.NXDOMAIN):
+        return "not_listed", []
+    if isinstance(outcome, dns.exception.Timeout):
+        return "timeout", []
+    if isinstance(outcome, BaseException):
+        return "error", []
+
+    return None, [str(rdata.address) for rdata in outcome]
+
+
+DNSBL_VERDICT_TTL = {
+    "listed": DNSBL_TTL_LISTED,
+    "reputation": DNSBL_TTL_LISTED,
+    "not_listed": DNSBL_TTL_NOT_LISTED,
+    "blocked": DNSBL_TTL_BLOCKED,
+    "timeout": DNSBL_TTL_TIMEOUT,
+    "error": DNSBL_TTL_TIMEOUT,
+}
+
+
+def read_dnsbl_verdicts(pairs: list) -> list:
+    if not pairs:
+        return []
+
+    try:
+        values = get_cache().mget([dnsbl_key(target, dnsbl) for target, dnsbl in pairs])
+    except Exception as e:
+        print("dnsbl cache okunamadi:", repr(e), flush=True)
+        return [None] * len(pairs)
+
+    return [json.loads(v) if v else None for v in values]
+
+
+def save_dnsbl_verdicts(verdicts: list):
+    verdicts = [(pair, v) for pair, v in verdicts if DNSBL_VERDICT_TTL.get(v["status"], 0) > 0]
+    if not verdicts:
+        return
+
+    try:
+        pipe = get_cache().pipeline(transaction=False)
+        for (target, dnsbl), verdict in verdicts:
+            pipe.set(dnsbl_key(target, dnsbl), json.dumps(verdict), ex=DNSBL_VERDICT_TTL[verdict["status"]])
+        pipe.execute()
+    except Exception as e:
+        print("dnsbl cache yazilamadi:", repr(e), flush=True)
+
+
+def query_dnsbls(pairs: list, classify) -> list:
+    verdicts = read_dnsbl_verdicts(pairs)
+    active, skipped, hedge = dnsbl_health.plan(list(dict.fromkeys(dnsbl for _, dnsbl in pairs)))
+    rank = {dnsbl: i for i, dnsbl in enumerate(active)}
+
+    for i, (_, dnsbl) in enumerate(pairs):
+        if verdicts[i] is None and dnsbl in skipped:
+            verdicts[i] = {"status": "skipped", "addresses": [], "cached": False}
+
+    missing = sorted((i for i, verdict in enumerate(verdicts) if verdict is None), key=lambda i: rank[pairs[i][1]])
+    names = {i: f"{pairs[i][0]}.{pairs[i][1]}" for i in missing}
+
+    resolver = get_resolver(timeout=DNSBL_TIMEOUT, lifetime=DNSBL_LIFETIME)
+    outcomes = resolver.resolve_many([(names[i], "A") for i in missing], DNSBL_CONCURRENCY,
+                                     {names[i]: hedge[pairs[i][1]] for i in missing if pairs[i][1] in hedge})
+
+    fresh = []
+    samples = []
+    for i, outcome in zip(missing, outcomes):
+        status, addresses = _dnsbl_outcome(outcome)
+        verdicts[i] = {"status": status or classify(pairs[i][1], addresses), "addresses": addresses}
+        fresh.append((pairs[i], verdicts[i]))
+        if names[i] in resolver.elapsed:
+            samples.append((pairs[i][1], verdicts[i]["status"], resolver.elapsed[names[i]]))
+
+    save_dnsbl_verdicts(fresh)
+    dnsbl_health.record(samples)
+
+    fetched = set(missing)
+    for i, verdict in enumerate(verdicts):
+        verdict.setdefault("cached", i not in fetched)
+
+    return verdicts
+
+
 def _domain_dnsbl_status(addresses: list) -> str:
     for address in addresses:
         if address.startswith("127.255.255.") or address == "127.0.0.1":
@@ -397,33 +476,20 @@ def check_domain_blacklists(domains: list) -> dict:
     if not targets:
         return {"checked": 0, "results": {}, "listed": [], "summary": summary}
 
-    resolver = get_resolver(timeout=DNSBL_TIMEOUT, lifetime=DNSBL_LIFETIME)
-
-    def query_one(domain: str, dnsbl: str):
-        try:
-            answer = resolver.resolve(f"{domain}.{dnsbl}", "A")
-            return domain, dnsbl, _domain_dnsbl_status([str(r.address) for r in answer])
-        except dns.resolver.NXDOMAIN:
-            return domain, dnsbl, "not_listed"
-        except (dns.resolver.Timeout, dns.exception.Timeout):
-            return domain, dnsbl, "timeout"
-        except Exception:
-            return domain, dnsbl, "error"
-
     results = {}
     listed = []
     jobs = [(domain, dnsbl) for domain in targets for dnsbl in DOMAIN_DNSBL_LISTS]
+    verdicts = query_dnsbls(jobs, lambda dnsbl, addresses: _domain_dnsbl_status(addresses))
 
-    with ThreadPoolExecutor(max_workers=max(1, DNSBL_CONCURRENCY)) as ex:
-        futures = [ex.submit(query_one, domain, dnsbl) for domain, dnsbl in jobs]
-        for fut in as_completed(futures):
-            domain, dnsbl, status = fut.result()
-            results.setdefault(domain, {})[dnsbl] = status
-            summary[status] += 1
-            if status == "listed":
-                listed.append({"domain": domain, "list": dnsbl})
+    for (domain, dnsbl), verdict in zip(jobs, verdicts):
+        status = verdict["status"]
+        results.setdefault(domain, {})[dnsbl] = status
+        summary[status] += 1
+        if status == "listed":
+            listed.append({"domain": domain, "list": dnsbl})
 
-    return {"checked": len(jobs), "results": results, "listed": listed, "summary": summary}
+    return {"checked": len(jobs), "results": results, "listed": listed, "summary": summary,
+            "cached": sum(1 for v in verdicts if v["cached"])}
 
 
 DNSBL_LISTED_CODES = {
@@ -434,7 +500,7 @@ DNSBL_LISTED_CODES = {
 
 DEFAULT_LISTED_CODES = ("127.0.0.2",)
 
-EMPTY_SUMMARY = {"listed": 0, "not_listed": 0, "reputation": 0, "timeout": 0, "blocked": 0, "error": 0}
+EMPTY_SUMMARY = {"listed": 0, "not_listed": 0, "reputation": 0, "timeout": 0, "blocked": 0, "error": 0, "skipped": 0}
 
 
 def _ip_dnsbl_status(dnsbl: str, addresses: list) -> str:
@@ -457,38 +523,23 @@ def check_blacklists(ip: str) -> dict:
 
     reversed_ip = ".".join(ip.split(".")[::-1])
 
-    resolver = get_resolver(timeout=DNSBL_TIMEOUT, lifetime=DNSBL_LIFETIME)
-
     dnsbls = DNSBL_LISTS[:DNSBL_MAX_LISTS]
     results = {}
     answers = {}
 
-    def query_one(dnsbl: str):
-        q = f"{reversed_ip}.{dnsbl}"
-        try:
-            answer = resolver.resolve(q, "A")
-            addresses = [str(rdata.address) for rdata in answer]
-            return dnsbl, _ip_dnsbl_status(dnsbl, addresses), addresses
-        except dns.resolver.NXDOMAIN:
-            return dnsbl, "not_listed", []
-        except (dns.resolver.Timeout, dns.exception.Timeout):
-            return dnsbl, "timeout", []
-        except Exception:
-            return dnsbl, "error", []
+    verdicts = query_dnsbls([(reversed_ip, dnsbl) for dnsbl in dnsbls], _ip_dnsbl_status)
 
-    with ThreadPoolExecutor(max_workers=max(1, DNSBL_CONCURRENCY)) as ex:
-        futures = [ex.submit(query_one, dnsbl) for dnsbl in dnsbls]
-        for fut in as_completed(futures):
-            dnsbl, status, addresses = fut.result()
-            results[dnsbl] = status
-            if addresses:
-                answers[dnsbl] = addresses
+    for dnsbl, verdict in zip(dnsbls, verdicts):
+        results[dnsbl] = verdict["status"]
+        if verdict["addresses"]:
+            answers[dnsbl] = verdict["addresses"]
 
     summary = dict(EMPTY_SUMMARY)
     for st in results.values():
         summary[st] += 1
 
-    return {"checked": len(results), "results": results, "answers": answers, "summary": summary}
+    return {"checked": len(results), "results": results, "answers": answers, "summary": summary,
+            "cached": sum(1 for v in verdicts if v["cached"])}
 
 def get_mx_record(domain: str):
     try:
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 
 broker = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 backend = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
@@ -19,3 +20,16 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
 )
+
+
+@worker_process_init.connect
+def load_dns_cache(**kwargs):
+    from src.processor.dns_cache import load_snapshot
+    load_snapshot()
+
+
+@worker_process_shutdown.connect
+def save_dns_cache(**kwargs):
+    from src.processor.dns_cache import save_snapshot, stats
+    save_snapshot()
+    print("dns cache:", stats(), flush=True)
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import time
+import uuid
+import zlib
+
+from src.config import DELIVERY_CACHE_TTL, DELIVERY_LOCK_TIMEOUT
+from src.db.cache import delivery_key, delivery_lock_key, get_raw_cache
+from src.db.reports import dump_json
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+WAIT_STEP = 0.25
+
+
+def delivery_digest(event: dict) -> str:
+    content = event.get("content_sha256") or event.get("sha256") or event.get("raw_id") or ""
+    identity = [content, event.get("connection") or {}, (event.get("mail_from") or "").strip().lower()]
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def read_shared(cache, digest: str):
+    body = cache.get(delivery_key(digest))
+    if body is None:
+        return None
+    return json.loads(zlib.decompress(body))
+
+
+def store_shared(cache, digest: str, analysis: dict):
+    try:
+        cache.set(delivery_key(digest), zlib.compress(dump_json(analysis)), ex=DELIVERY_CACHE_TTL)
+    except Exception as e:
+        print("teslimat analizi onbellege yazilamadi:", digest, repr(e), flush=True)
+
+
+def release(cache, digest: str, token: str):
+    try:
+        cache.register_script(RELEASE_SCRIPT)(keys=[delivery_lock_key(digest)], args=[token])
+    except Exception as e:
+        print("teslimat kilidi birakilamadi:", digest, repr(e), flush=True)
+
+
+def shared_analysis(digest: str, compute) -> dict:
+    if DELIVERY_CACHE_TTL <= 0:
+        return compute()
+
+    cache = get_raw_cache()
+    token = uuid.uuid4().hex
+
+    try:
+        shared = read_shared(cache, digest)
+        if shared is not None:
+            return shared
+        owner = cache.set(delivery_lock_key(digest), token, nx=True, ex=DELIVERY_LOCK_TIMEOUT)
+    except Exception as e:
+        print("teslimat analizi okunamadi:", digest, repr(e), flush=True)
+        return compute()
+
+    if owner:
+        try:
+            analysis = compute()
+            store_shared(cache, digest, analysis)
+            return analysis
+        finally:
+            release(cache, digest, token)
+
+    deadline = time.monotonic() + DELIVERY_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_STEP)
+        try:
+            shared = read_shared(cache, digest)
+            if shared is not None:
+                return shared
+            if not cache.exists(delivery_lock_key(digest)):
+                break
+        except Exception as e:
+            print("teslimat analizi okunamadi:", digest, repr(e), flush=True)
+            break
+
+    return compute()
@@ -1,9 +1,40 @@
 from datetime import datetime, timezone, timedelta
 
+import redis
 from bson import ObjectId
+from pymongo import UpdateOne
 
 from src.api.utils.time import ensure_utc_aware
-from src.config import ANON_DAILY_LIMIT, USER_DAILY_LIMIT, API_DAILY_LIMIT
+from src.config import ANON_DAILY_LIMIT, USER_DAILY_LIMIT, API_DAILY_LIMIT, QUOTA_FLUSH_DELAY
+from src.db.cache import get_async_cache, get_cache, quota_key
+
+QUOTA_DIRTY_KEY = "mailtester:quota:dirty"
+QUOTA_FLUSH_KEY = "mailtester:quota:flush"
+
+LEDGER_SCRIPT = """
+local used = redis.call('HGET', KEYS[1], 'used')
+if not used then
+    if ARGV[1] == '' then
+        return {-1, 0, 0}
+    end
+    redis.call('HSET', KEYS[1], 'used', ARGV[2], 'limit', ARGV[1])
+    redis.call('EXPIREAT', KEYS[1], ARGV[3])
+    used = ARGV[2]
+end
+used = tonumber(used)
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit'))
+local take = tonumber(ARGV[4])
+if take > 0 then
+    if used + take > limit then
+        return {0, used, limit}
+    end
+    used = redis.call('HINCRBY', KEYS[1], 'used', take)
+    if ARGV[5] == '1' then
+        redis.call('SADD', KEYS[2], KEYS[1])
+    end
+end
+return {1, used, limit}
+"""
 
 
 def utc_now():
@@ -27,18 +58,22 @@ def get_test_email_context(db, to_address: str) -> dict:
     )
 
 
-def get_anonymous_daily_usage(db, client_ip: str, current_time: datetime) -> int:
-    return db.mail_events.count_documents({
+def anonymous_usage_query(client_ip: str, current_time: datetime) -> dict:
+    return {
         "created_ip": client_ip,
         "analysis_id": {"$ne": None},
         "analyzed_at": {"$gte": utc_day_start(current_time)}
-    })
+    }
+
+
+def get_anonymous_daily_usage(db, client_ip: str, current_time: datetime) -> int:
+    return db.mail_events.count_documents(anonymous_usage_query(client_ip, current_time))
 
 
 def claim_mail_event(db, event_id) -> bool:
     claimed = db.mail_events.update_one(
         {"_id": ObjectId(event_id), "analysis_started_at": None},
-        {"$set": {"analysis_started_at": utc_now()}}
+        {"$set": {"analysis_started_at": utc_now(), "outbox": False}}
     )
     return claimed.modified_count == 1
 
@@ -51,22 +86,99 @@ def quota_holder(db, owner_user_id: str = None, api_key_id: str = None):
     return None, None, None, None, "anonymous"
 
 
-def consume_daily_quota(db, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> bool:
+def holder_quota(holder: dict, path: str, default_limit: int, now: datetime) -> tuple:
+    quota = holder
+    for part in path.split("."):
+        quota = (quota or {}).get(part) or {}
+
+    limit = int(quota.get("daily_limit", default_limit))
+    used = int(quota.get("daily_used", 0))
+    reset_at = ensure_utc_aware(quota.get("reset_at"))
+
+    if (reset_at is None) or (reset_at <= now):
+        return limit, 0, None
+
+    return limit, used, reset_at
+
+
+def read_holder_quota(collection, query, path, default_limit, now: datetime) -> tuple:
+    holder = collection.find_one(query, {path.split(".")[0]: 1}) or {}
+    return holder_quota(holder, path, default_limit, now)
+
+
+def read_mongo_quota(db, now: datetime, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> tuple:
+    collection, query, path, default_limit, scope = quota_holder(db, owner_user_id, api_key_id)
+
+    if collection is None:
+        return ANON_DAILY_LIMIT, get_anonymous_daily_usage(db, client_ip or "unknown", now)
+
+    limit, used, _ = read_holder_quota(collection, query, path, default_limit, now)
+    return limit, used
+
+
+async def read_mongo_quota_async(db, now: datetime, owner_user_id: str = None, client_ip: str = None,
+                                 api_key_id: str = None) -> tuple:
+    collection, query, path, default_limit, scope = quota_holder(db, owner_user_id, api_key_id)
+
+    if collection is None:
+        return ANON_DAILY_LIMIT, await db.mail_events.count_documents(anonymous_usage_query(client_ip or "unknown", now))
+
+    holder = await collection.find_one(query, {path.split(".")[0]: 1}) or {}
+    limit, used, _ = holder_quota(holder, path, default_limit, now)
+    return limit, used
+
+
+def ledger_holder(owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> tuple:
+    if api_key_id:
+        return "api_key", api_key_id
+    if owner_user_id:
+        return "user", owner_user_id
+    return "anonymous", client_ip or "unknown"
+
+
+def ledger_call(now: datetime, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> tuple:
+    scope, holder = ledger_holder(owner_user_id, client_ip, api_key_id)
+    keys = [quota_key(scope, holder, now.strftime("%Y%m%d")), QUOTA_DIRTY_KEY]
+    expire_at = int(get_utc_tomorrow_start(now).timestamp()) + 86400
+    return scope, keys, expire_at, "0" if scope == "anonymous" else "1"
+
+
+def run_ledger(db, now: datetime, take: int, owner_user_id: str = None, client_ip: str = None,
+               api_key_id: str = None) -> tuple:
+    scope, keys, expire_at, dirty = ledger_call(now, owner_user_id, client_ip, api_key_id)
+
+    script = get_cache().register_script(LEDGER_SCRIPT)
+    reply = script(keys=keys, args=["", 0, expire_at, take, dirty])
+
+    if reply[0] == -1:
+        limit, used = read_mongo_quota(db, now, owner_user_id, client_ip, api_key_id)
+        reply = script(keys=keys, args=[limit, used, expire_at, take, dirty])
+
+    return scope, reply[0] == 1, int(reply[1]), int(reply[2])
+
+
+async def run_ledger_async(db, now: datetime, take: int, owner_user_id: str = None, client_ip: str = None,
+                           api_key_id: str = None) -> tuple:
+    scope, keys, expire_at, dirty = ledger_call(now, owner_user_id, client_ip, api_key_id)
+
+    script = get_async_cache().register_script(LEDGER_SCRIPT)
+    reply = await script(keys=keys, args=["", 0, expire_at, take, dirty])
+
+    if reply[0] == -1:
+        limit, used = await read_mongo_quota_async(db, now, owner_user_id, client_ip, api_key_id)
+        reply = await script(keys=keys, args=[limit, used, expire_at, take, dirty])
+
+    return scope, reply[0] == 1, int(reply[1]), int(reply[2])
+
+
+def consume_daily_quota_mongo(db, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> bool:
     now = utc_now()
     collection, query, path, default_limit, scope = quota_holder(db, owner_user_id, api_key_id)
 
     if collection is not None:
-        holder = collection.find_one(query, {path.split(".")[0]: 1}) or {}
-        quota = holder
-        for part in path.split("."):
-            quota = (quota or {}).get(part) or {}
-
-        daily_limit = int(quota.get("daily_limit", default_limit))
-        daily_used = int(quota.get("daily_used", 0))
-        reset_at = ensure_utc_aware(quota.get("reset_at"))
+        daily_limit, daily_used, reset_at = read_holder_quota(collection, query, path, default_limit, now)
 
-        if (reset_at is None) or (reset_at <= now):
-            daily_used = 0
+        if reset_at is None:
             collection.update_one(query, {"$set": {
                 f"{path}.daily_used": 0,
                 f"{path}.reset_at": get_utc_tomorrow_start(now),
@@ -81,31 +193,91 @@ def consume_daily_quota(db, owner_user_id: str = None, client_ip: str = None, ap
     return get_anonymous_daily_usage(db, client_ip or "unknown", now) < ANON_DAILY_LIMIT
 
 
-def get_quota_state(db, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> dict:
-    now = utc_now()
-    collection, query, path, default_limit, scope = quota_holder(db, owner_user_id, api_key_id)
-
-    if collection is not None:
-        holder = collection.find_one(query, {path.split(".")[0]: 1}) or {}
-        quota = holder
-        for part in path.split("."):
-            quota = (quota or {}).get(part) or {}
+def consume_daily_quota(db, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> bool:
+    try:
+        _, allowed, _, _ = run_ledger(db, utc_now(), 1, owner_user_id, client_ip, api_key_id)
+        return allowed
+    except redis.RedisError as e:
+        print("kota defteri kullanilamadi:", repr(e), flush=True)
+        return consume_daily_quota_mongo(db, owner_user_id, client_ip, api_key_id)
 
-        limit = int(quota.get("daily_limit", default_limit))
-        used = int(quota.get("daily_used", 0))
-        reset_at = ensure_utc_aware(quota.get("reset_at"))
 
-        if (reset_at is None) or (reset_at <= now):
-            used = 0
-            reset_at = get_utc_tomorrow_start(now)
+def get_quota_state(db, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> dict:
+    now = utc_now()
 
-        return {"scope": scope, "limit": limit, "used": used,
-                "remaining": max(0, limit - used), "reset_at": reset_at}
+    try:
+        scope, _, used, limit = run_ledger(db, now, 0, owner_user_id, client_ip, api_key_id)
+    except redis.RedisError as e:
+        print("kota defteri okunamadi:", repr(e), flush=True)
+        scope = quota_holder(db, owner_user_id, api_key_id)[4]
+        limit, used = read_mongo_quota(db, now, owner_user_id, client_ip, api_key_id)
 
-    used = get_anonymous_daily_usage(db, client_ip or "unknown", now)
+    return quota_state(scope, limit, used, now)
 
-    return {"scope": "anonymous", "limit": ANON_DAILY_LIMIT, "used": used,
-            "remaining": max(0, ANON_DAILY_LIMIT - used),
-            "reset_at": get_utc_tomorrow_start(now)}
 
+async def get_quota_state_async(db, owner_user_id: str = None, client_ip: str = None, api_key_id: str = None) -> dict:
+    now = utc_now()
 
+    try:
+        scope, _, used, limit = await run_ledger_async(db, now, 0, owner_user_id, client_ip, api_key_id)
+    except redis.RedisError as e:
+        print("kota defteri okunamadi:", repr(e), flush=True)
+        scope = quota_holder(db, owner_user_id, api_key_id)[4]
+        limit, used = await read_mongo_quota_async(db, now, owner_user_id, client_ip, api_key_id)
+
+    return quota_state(scope, limit, used, now)
+
+
+def quota_state(scope: str, limit: int, used: int, now: datetime) -> dict:
+    return {"scope": scope, "limit": limit, "used": used,
+            "remaining": max(0, limit - used), "reset_at": get_utc_tomorrow_start(now)}
+
+
+def claim_quota_flush() -> bool:
+    try:
+        return bool(get_cache().set(QUOTA_FLUSH_KEY, "1", nx=True, ex=max(1, QUOTA_FLUSH_DELAY)))
+    except redis.RedisError:
+        return False
+
+
+def flush_quota_ledger(db, batch: int = 500) -> int:
+    cache = get_cache()
+    flushed = 0
+
+    while True:
+        keys = cache.spop(QUOTA_DIRTY_KEY, batch)
+        if not keys:
+            return flushed
+
+        try:
+            pipe = cache.pipeline(transaction=False)
+            for key in keys:
+                pipe.hget(key, "used")
+
+            updates = {}
+            for key, used in zip(keys, pipe.execute()):
+                if used is None:
+                    continue
+
+                _, _, day, scope, holder = key.split(":", 4)
+                reset_at = datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc) + timedelta(days=1)
+                collection, query, path, _, _ = quota_holder(
+                    db,
+                    owner_user_id=holder if scope == "user" else None,
+                    api_key_id=holder if scope == "api_key" else None,
+                )
+
+                query = dict(query, **{f"{path}.reset_at": {"$not": {"$gt": reset_at}}})
+                updates.setdefault(collection.name, []).append(UpdateOne(query, {"$set": {
+                    f"{path}.daily_used": int(used),
+                    f"{path}.reset_at": reset_at,
+                }}))
+
+            for name, requests in updates.items():
+                db[name].bulk_write(requests, ordered=False)
+        except Exception as e:
+            cache.sadd(QUOTA_DIRTY_KEY, *keys)
+            print("kota defteri yazilamadi:", repr(e), flush=True)
+            return flushed
+
+        flushed += len(keys)
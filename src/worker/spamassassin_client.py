@@ -4,7 +4,7 @@ import socket
 from src.config import SPAMD_TIMEOUT, SPAMD_PORT, SPAMD_HOST
 
 
-def spamd_check(raw_email: bytes, host: str = None, port: int = None, timeout: float = None) -> dict:
+def spamd_check(raw_email, host: str = None, port: int = None, timeout: float = None) -> dict:
     host = host or SPAMD_HOST
     port = int(port or SPAMD_PORT)
     timeout = float(timeout or SPAMD_TIMEOUT)
@@ -13,12 +13,12 @@ def spamd_check(raw_email: bytes, host: str = None, port: int = None, timeout: f
         s = socket.create_connection((host, port), timeout=timeout)
         s.settimeout(timeout)
 
-        req = (
+        s.sendall(
             b"REPORT SPAMC/1.5\r\n"
             b"Content-length: " + str(len(raw_email)).encode() + b"\r\n"
-            b"\r\n" + raw_email
+            b"\r\n"
         )
-        s.sendall(req)
+        s.sendall(raw_email)
 
         data = b""
         while True:
@@ -1,15 +1,19 @@
-import email
 from datetime import datetime, timezone
 from email.utils import parseaddr
 
 import gridfs
 from bson import ObjectId
 
+from src.config import QUOTA_FLUSH_DELAY
+from src.db.cache import publish_status
 from src.db.db import get_db
+from src.db.reports import store_report
 from src.processor.analyzer import Analyzer
+from src.processor.message import ParsedMessage
 from src.processor.service import get_sender_ip
 from src.worker.celery_app import celery_app
-from src.worker.limits import claim_mail_event, consume_daily_quota
+from src.worker.deliveries import delivery_digest, shared_analysis
+from src.worker.limits import claim_mail_event, claim_quota_flush, consume_daily_quota, flush_quota_ledger
 
 
 def get_sender_domain(msg) -> str:
@@ -19,6 +23,30 @@ def get_sender_domain(msg) -> str:
     return address.rsplit("@", 1)[-1].strip().lower()
 
 
+def analyze_delivery(db, event: dict) -> dict:
+    fs = gridfs.GridFS(db, collection="raw_mails")
+    message = ParsedMessage(fs.get(ObjectId(event["raw_id"])).read())
+
+    connection = event.get("connection") or {}
+    sender_ip = connection.get("client_ip") or get_sender_ip(message)
+    domain = get_sender_domain(message)
+
+    analyzer = Analyzer(
+        message=message,
+        domain=domain,
+        sender_ip=sender_ip,
+        connection=connection,
+        envelope_from=event.get("mail_from"),
+    )
+
+    return {"result": analyzer.analyze(), "sender_ip": sender_ip, "sender_domain": domain}
+
+
+@celery_app.task
+def flush_quota():
+    return flush_quota_ledger(get_db())
+
+
 @celery_app.task(bind=True, max_retries=3)
 def analyze_received_mail(self, mail_event_id: str):
     db = get_db()
@@ -49,30 +77,24 @@ def analyze_received_mail(self, mail_event_id: str):
                 {"to_address": to_address},
                 {"$set": {"status": "limit", "last_error": "daily_analyze_limit_exceeded"}}
             )
+            publish_status(to_address, "limit", event)
             return None
 
+        if (event.get("owner_user_id") or event.get("api_key_id")) and claim_quota_flush():
+            flush_quota.apply_async(countdown=QUOTA_FLUSH_DELAY)
+
         db.test_emails.update_one(
             {"to_address": to_address},
             {"$set": {"status": "processing", "last_error": None}}
         )
+        publish_status(to_address, "processing", event)
 
-        fs = gridfs.GridFS(db, collection="raw_mails")
-        raw = fs.get(ObjectId(event["raw_id"])).read()
-        msg = email.message_from_bytes(raw)
-
+        digest = delivery_digest(event)
+        shared = shared_analysis(digest, lambda: analyze_delivery(db, event))
+        result = shared["result"]
+        sender_ip = shared["sender_ip"]
+        domain = shared["sender_domain"]
         connection = event.get("connection") or {}
-        sender_ip = connection.get("client_ip") or get_sender_ip(msg)
-        domain = get_sender_domain(msg)
-
-        analyzer = Analyzer(
-            email_message=msg,
-            domain=domain,
-            sender_ip=sender_ip,
-            raw_email=raw,
-            connection=connection,
-            envelope_from=event.get("mail_from"),
-        )
-        result = analyzer.analyze()
 
         result["spamassassin"] = result["checks"]["spamassassin"]
         result["connection"] = connection
@@ -83,6 +105,7 @@ def analyze_received_mail(self, mail_event_id: str):
             "sender_domain": domain,
             "sender_ip": sender_ip,
             "envelope_from": event.get("mail_from"),
+            "delivery": digest,
         })
         result["owner"] = {
             "type": "user" if event.get("owner_user_id") else "anonymous",
@@ -93,10 +116,11 @@ def analyze_received_mail(self, mail_event_id: str):
 
         inserted = db.analyses.insert_one(result)
         now = datetime.now(timezone.utc)
+        store_report(result)
 
         db.mail_events.update_one(
             {"_id": ObjectId(mail_event_id)},
-            {"$set": {"analysis_id": str(inserted.inserted_id), "analyzed_at": now}}
+            {"$set": {"analysis_id": str(inserted.inserted_id), "analyzed_at": now, "delivery": digest}}
         )
 
         db.test_emails.update_one(
@@ -108,6 +132,8 @@ def analyze_received_mail(self, mail_event_id: str):
                 "last_error": None,
             }}
         )
+        publish_status(to_address, "analyzed", event, analysis_id=str(inserted.inserted_id),
+                       analyzed_event_id=mail_event_id)
 
         return None
 
@@ -120,4 +146,5 @@ def analyze_received_mail(self, mail_event_id: str):
             {"to_address": to_address},
             {"$set": {"status": "error", "last_error": repr(e)}}
         )
+        publish_status(to_address, "error", event, detail=repr(e))
         raise